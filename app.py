@@ -3,15 +3,20 @@ SAR-BOT PRO - YOLO PERSON DETECTION
 Sử dụng YOLOv8 để nhận diện người CHÍNH XÁC
 """
 
-from flask import Flask, render_template, Response, jsonify
+from flask import Flask, render_template, Response, jsonify, request
 import cv2
 import numpy as np
-from datetime import datetime
 import threading
 import time
 import random
-from queue import Queue
-from ultralytics import YOLO
+from detection import (DEFAULT_SOURCE, DetectionSlot, Detections, ProcessDetector, create_detector,
+                       detect_in_regions, roi_regions)
+from stream import (AdaptiveBitrate, CaptureThread, EncodedFrameCache, FramePacer, StreamProfile,
+                    dashboard_events, detection_events, encode_jpeg_chunk, parse_profile, profile_size)
+from eventlog import DebugChannel, LogRing, LogThrottle
+from motion import MotionGate
+from overlay import OverlayCompositor
+from tracking import BoxTracker
 
 app = Flask(__name__)
 
@@ -25,17 +30,38 @@ STREAM_HEIGHT = 360
 DETECTION_INTERVAL = 1  # Detect mỗi 1 giây vì YOLO nhanh
 JPEG_QUALITY = 60
 TARGET_FPS = 15
+DETECTOR_BACKEND = "ultralytics"  # "ultralytics" (PyTorch) | "onnx" (cv2.dnn, không cần torch) | "hog"
+DETECTOR_MODEL = "yolov8n.pt"     # Backend onnx: "yolov8n.onnx" (yolo export model=yolov8n.pt format=onnx)
+DETECTOR_INT8 = False  # Backend onnx: chạy bản INT8 yolov8n_int8.onnx (python benchmark.py quantize), cần onnxruntime
+DETECTOR_RUNTIME = None  # Backend onnx: "dnn" (cv2.dnn) | "onnxruntime" (pip install onnxruntime); None = dnn, INT8 = onnxruntime
+DETECTION_WORKERS = 0   # >0: chạy YOLO trong N process riêng (tránh tranh GIL với stream)
+DETECTION_BATCH = 4     # Số camera tối đa gộp vào một lần chạy YOLO
+DETECTION_BATCH_WINDOW = 0.05  # Giây chờ camera khác trước khi chạy batch
+ADAPTIVE_BITRATE = True  # Tự động tăng/giảm chất lượng theo tốc độ mạng của từng viewer
+CLIENT_SIDE_BOXES = False  # Stream frame sạch, dashboard vẽ box từ /api/detections/stream (?boxes=client|server)
+LOG_RATE_INTERVAL = 5.0  # Giây - log lặp lại trong khoảng này được gộp thành một entry (có số lần)
+DEBUG_LOG = False        # In debug mỗi frame (lấy mẫu, tối đa một dòng mỗi DEBUG_LOG_INTERVAL giây mỗi loại)
+DEBUG_LOG_INTERVAL = 1.0
+TRACKING = True  # Dời box theo người giữa hai lần detect (optical flow)
+MOTION_GATE = True      # Chỉ detect khi khung hình có chuyển động
+MOTION_INTERVAL = 0.5   # Có chuyển động: detect nhanh hơn DETECTION_INTERVAL
+STATIC_INTERVAL = 10    # Đứng yên: vẫn detect mỗi 10 giây để xác nhận
+ROI_DETECTION = True    # Chỉ detect trong vùng chuyển động / vùng đang track
+ROI_FULL_FRAME_INTERVAL = 5  # Giây - định kỳ detect cả frame
+ROI_MIN_SIZE = (160, 160)  # Crop nhỏ nhất, YOLO phóng crop lên 640
 
 # Global variables
-camera = None
-camera_lock = threading.Lock()
-system_logs = []
+system_logs = LogRing(capacity=200)
+log_throttle = LogThrottle(system_logs, interval=LOG_RATE_INTERVAL)
+debug = DebugChannel(DEBUG_LOG, interval=DEBUG_LOG_INTERVAL)
 detected_persons = 0
-detection_boxes = []
+current_detections = Detections()  # Snapshot bất biến, thay cả object khi có kết quả mới
 last_detection_time = 0
 is_recording = False
-camera_reconnect_attempts = 0
 detection_active = False
+last_full_detection = 0  # Lần cuối detect cả frame (ROI mode)
+latest_result_id = 0    # Frame id của kết quả detection đang hiển thị
+detector_pool = None    # ProcessDetector khi DETECTION_WORKERS > 0
 
 # Sensor data
 sensor_data = {
@@ -47,87 +73,127 @@ sensor_data = {
     "battery_level": 84
 }
 
-# Initialize YOLO model
-print("🤖 Loading YOLOv8 model...")
-model = YOLO('yolov8n.pt')  # YOLOv8 nano - nhanh nhất
-print("✅ YOLO model loaded successfully!")
-
-# Frame queue for detection
-detection_queue = Queue(maxsize=1)
-
-def add_log(message):
-    """Add a new log entry"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    system_logs.insert(0, {"time": timestamp, "message": message})
-    if len(system_logs) > 50:
-        system_logs.pop()
-
-def init_camera():
-    """Initialize camera"""
-    global camera, camera_reconnect_attempts
-    with camera_lock:
-        if camera is None:
-            try:
-                if USE_RTSP:
-                    add_log("🔌 Đang kết nối EZVIZ camera...")
-                    
-                    import os
-                    os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = (
-                        "rtsp_transport;tcp|"
-                        "fflags;nobuffer|"
-                        "flags;low_delay|"
-                        "framedrop;1"
-                    )
-                    
-                    camera = cv2.VideoCapture(RTSP_URL, cv2.CAP_FFMPEG)
-                    camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                    camera.set(cv2.CAP_PROP_FPS, TARGET_FPS)
-                else:
-                    add_log("🔌 Đang kết nối webcam local...")
-                    camera = cv2.VideoCapture(0)
-                    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 360)
-                
-                if camera.isOpened():
-                    add_log("✅ Camera kết nối - YOLO MODE")
-                    add_log(f"🎯 YOLOv8 Person Detection: ACTIVE")
-                    camera_reconnect_attempts = 0
-                else:
-                    add_log("❌ LỖI: Không thể kết nối camera")
-                    camera = None
-                    
-            except Exception as e:
-                add_log(f"❌ LỖI: {str(e)}")
-                camera = None
-
-def detect_persons_yolo(frame):
-    """Detect persons using YOLO - CỰC CHÍNH XÁC"""
-    global detected_persons, detection_boxes, detection_active
+# Initialize detector (worker processes tự load model riêng)
+DETECTOR_OPTIONS = {"backend": DETECTOR_BACKEND, "model_path": DETECTOR_MODEL, "conf": 0.25,
+                    "int8": DETECTOR_INT8, "runtime": DETECTOR_RUNTIME}
+detector = None
+if DETECTION_WORKERS == 0:
+    print(f"🤖 Loading {DETECTOR_BACKEND} detector ({DETECTOR_MODEL})...")
+    detector = create_detector(**DETECTOR_OPTIONS)  # YOLOv8 nano - nhanh nhất
+    print("✅ Detector loaded successfully!")
+
+# Latest-frame handoff to the detection thread
+detection_slot = DetectionSlot()
+tracker = BoxTracker() if TRACKING else None
+motion_gate = MotionGate(MOTION_INTERVAL, STATIC_INTERVAL) if MOTION_GATE else None
+
+def add_log(message, key=None):
+    """Add a new log entry - repeats of the same key are rate-limited and coalesced"""
+    log_throttle.log(message, key)
+
+def on_camera_connect():
+    """Log camera connection"""
+    add_log("✅ Camera kết nối - YOLO MODE")
+    add_log(f"🎯 YOLOv8 Person Detection: ACTIVE")
+
+def plan_regions(frame_w, frame_h):
+    """Vùng cần detect: vùng chuyển động + người đang track; None = cả frame"""
+    global last_full_detection
+    
+    if ROI_DETECTION and time.time() - last_full_detection < ROI_FULL_FRAME_INTERVAL:
+        boxes = current_detections.scaled_to(frame_w, frame_h).tolist()
+        if motion_gate is not None:
+            boxes += motion_gate.regions((frame_w, frame_h))
+        regions = roi_regions(boxes, (frame_w, frame_h), min_size=ROI_MIN_SIZE)
+        if regions is not None:
+            return regions
+    
+    # Định kỳ detect cả frame để bắt người mới xuất hiện ngoài các vùng
+    last_full_detection = time.time()
+    return None
+
+def submit_detection(seq, frame):
+    """Called by the capture thread for every new frame - feed YOLO thread"""
+    global current_detections
+    
+    since_last = time.time() - last_detection_time
+    if motion_gate is not None:
+        # Cảnh tĩnh: bỏ qua detection, có chuyển động: detect sớm hơn
+        motion_gate.update(frame)
+        due = motion_gate.due(since_last)
+    else:
+        due = since_last >= DETECTION_INTERVAL
+    offer = due and detection_slot.idle()
+    
+    # Dời box theo người trên mọi frame, không đợi lần detect sau
+    if tracker is not None:
+        tracked = tracker.advance(seq, frame, keep=offer)
+        if tracked is not None:
+            current_detections = tracked
+    
+    if offer:
+        frame_detect = cv2.resize(frame, (STREAM_WIDTH, STREAM_HEIGHT), 
+                                  interpolation=cv2.INTER_LINEAR)
+        detection_slot.offer(frame_detect, seq, regions=plan_regions(STREAM_WIDTH, STREAM_HEIGHT))
+
+# Single capture thread shared by every /video_feed viewer
+capture = CaptureThread(
+    RTSP_URL,
+    use_rtsp=USE_RTSP,
+    target_fps=TARGET_FPS,
+    log=add_log,
+    on_connect=on_camera_connect,
+    on_frame=submit_detection,
+)
+
+def apply_detections(frame_id, result):
+    """Publish YOLO result - results from worker processes may arrive out of order"""
+    global detected_persons, current_detections, latest_result_id
+    
+    if frame_id is not None and frame_id < latest_result_id:
+        return
+    latest_result_id = frame_id or latest_result_id
+    
+    if tracker is not None:
+        current_detections = tracker.update(result.with_frame_id(frame_id))
+    else:
+        current_detections = result.with_frame_id(frame_id)
+    detected_persons = len(result)
+    
+    if detected_persons > 0:
+        add_log(f"👤 YOLO: PHÁT HIỆN {detected_persons} NGƯỜI!", key="detection")
+        debug("detect", "[YOLO] Detected %d persons", detected_persons)
+
+# Kết quả detection của từng camera (thêm camera = thêm một handler)
+detection_handlers = {DEFAULT_SOURCE: apply_detections}
+
+def apply_pool_result(job_id, result):
+    """Route a worker-process result back to the camera it came from"""
+    source, frame_id = job_id
+    detection_handlers[source](frame_id, result)
+
+def detect_persons_yolo(batch):
+    """Detect persons using YOLO - CỰC CHÍNH XÁC
+    
+    batch = [(source, frame_id, frame, regions)], mỗi camera tối đa một frame;
+    regions != None: chỉ detect trong các crop đó.
+    """
+    global detection_active
     
     detection_active = True
     
     try:
-        # Run YOLO inference
-        results = model(frame, conf=0.25, classes=[0], verbose=False)  # class 0 = person, confidence 25%
-        
-        detection_boxes = []
-        
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                # Get coordinates
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                conf = box.conf[0].cpu().numpy()
-                
-                # Convert to (x, y, w, h) format
-                x, y, w, h = int(x1), int(y1), int(x2-x1), int(y2-y1)
-                detection_boxes.append(((x, y, w, h), float(conf)))
-        
-        detected_persons = len(detection_boxes)
-        
-        if detected_persons > 0:
-            add_log(f"👤 YOLO: PHÁT HIỆN {detected_persons} NGƯỜI!")
-            print(f"[YOLO] Detected {detected_persons} persons")
+        if detector_pool is not None:
+            # Chạy trong worker process, kết quả về qua apply_pool_result
+            for source, frame_id, frame, regions in batch:
+                detector_pool.submit((source, frame_id), frame, regions=regions)
+        else:
+            # Một lần YOLO cho mọi crop của cả batch - class 0 = person, confidence 25%
+            frames = [frame for _, _, frame, _ in batch]
+            regions = [regions for _, _, _, regions in batch]
+            results = detect_in_regions(detector.batch, frames, regions)
+            for (source, frame_id, _, _), found in zip(batch, results):
+                detection_handlers[source](frame_id, found)
             
     except Exception as e:
         print(f"YOLO Detection error: {e}")
@@ -142,18 +208,27 @@ def detection_thread():
     
     while True:
         try:
-            if not detection_queue.empty():
-                frame = detection_queue.get()
-                detect_persons_yolo(frame)
+            log_throttle.flush()   # Ghi các log lặp lại đang chờ gộp
+            # Block until a capture thread offers a frame - no polling
+            batch = detection_slot.take_batch(timeout=1.0, max_items=DETECTION_BATCH,
+                                              window=DETECTION_BATCH_WINDOW)
+            if not batch:
+                continue
+            try:
+                detect_persons_yolo(batch)
+            finally:
                 last_detection_time = time.time()
-            time.sleep(0.05)
+                detection_slot.done()
         except Exception as e:
             print(f"Detection thread error: {e}")
             time.sleep(1)
 
-def draw_detections(frame):
+def draw_detections(frame, detections):
     """Draw YOLO detection boxes - RÕ RÀNG"""
-    for idx, ((x, y, w, h), conf) in enumerate(detection_boxes):
+    # Scale to display size - cả mảng một lần
+    boxes = detections.scaled_to(frame.shape[1], frame.shape[0])
+    for (x, y, w, h), conf, track_id in zip(boxes.tolist(), detections.scores.tolist(),
+                                            detections.track_ids.tolist()):
         # KHUNG CHÍNH - MÀU XANH LÁ NEON
         cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 4)
         
@@ -180,6 +255,8 @@ def draw_detections(frame):
         
         # LABEL với confidence
         label = f"PERSON {int(conf*100)}%"
+        if track_id > 0:
+            label = f"#{track_id} {label}"
         font = cv2.FONT_HERSHEY_SIMPLEX
         font_scale = 0.9
         font_thickness = 3
@@ -199,13 +276,14 @@ def draw_detections(frame):
     
     return frame
 
-def draw_overlay(frame):
-    """Draw overlay"""
+def draw_hud(frame, state):
+    """Draw HUD - chỉ gọi khi số người / trạng thái detect đổi (xem OverlayCompositor)"""
+    persons, active = state
     h, w = frame.shape[:2]
     
     # Detection counter
-    if detected_persons > 0:
-        counter_text = f"DETECTED: {detected_persons} PERSON(S)"
+    if persons > 0:
+        counter_text = f"DETECTED: {persons} PERSON(S)"
         text_size = cv2.getTextSize(counter_text, cv2.FONT_HERSHEY_SIMPLEX, 0.9, 2)[0]
         
         cv2.rectangle(frame, (10, 10), (20 + text_size[0], 45 + text_size[1]), (0, 255, 0), -1)
@@ -214,7 +292,7 @@ def draw_overlay(frame):
     
     # YOLO indicator
     yolo_text = "YOLO"
-    if detection_active:
+    if active:
         cv2.circle(frame, (w - 30, 30), 12, (0, 255, 0), -1)
     cv2.putText(frame, yolo_text, (w - 55, 37), 
                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
@@ -234,92 +312,84 @@ def draw_overlay(frame):
     
     return frame
 
-def reconnect_camera():
-    """Reconnect camera"""
-    global camera, camera_reconnect_attempts
+# HUD vẽ sẵn theo độ phân giải + nội dung, mỗi frame chỉ copy các pixel của HUD
+hud = OverlayCompositor(draw_hud)
+
+def draw_overlay(frame):
+    """Composite the cached HUD onto the frame"""
+    active = detection_active or (detector_pool is not None and detector_pool.in_flight > 0)
+    return hud.apply(frame, (detected_persons, active))
+
+# Encoded frames shared by all viewers on the same profile
+DEFAULT_PROFILE = StreamProfile(STREAM_WIDTH, STREAM_HEIGHT, JPEG_QUALITY, TARGET_FPS)
+frame_cache = EncodedFrameCache(max_entries=16)
+
+def render_frame(seq, frame, profile, draw_boxes=True):
+    """Resize, annotate and encode one captured frame for a stream profile
+
+    draw_boxes=False: box do dashboard vẽ trên canvas, frame chỉ có HUD.
+    """
+    # Resize for streaming
+    width, height = profile_size(profile, frame.shape[1], frame.shape[0])
+    frame_display = cv2.resize(frame, (width, height), 
+                               interpolation=cv2.INTER_LINEAR)
     
-    with camera_lock:
-        if camera is not None:
-            camera.release()
-            camera = None
-        
-        camera_reconnect_attempts += 1
-        add_log(f"🔄 Kết nối lại... (lần {camera_reconnect_attempts})")
-        
-    time.sleep(2)
-    init_camera()
+    # Draw detection boxes
+    detections = current_detections
+    if draw_boxes and len(detections) > 0:
+        frame_display = draw_detections(frame_display, detections)
+    
+    # Draw overlay
+    frame_display = draw_overlay(frame_display)
+    
+    chunk = encode_jpeg_chunk(frame_display, profile.quality)
+    # Slot ring bị ghi đè trong lúc đọc: bỏ frame thay vì gửi ảnh bị xé
+    if not capture.is_intact(seq, frame):
+        return None
+    return chunk
 
-def generate_frames():
+def generate_frames(profile=DEFAULT_PROFILE, adaptive=ADAPTIVE_BITRATE, client="", draw_boxes=True):
     """Generate video frames with YOLO detection"""
-    global camera, camera_reconnect_attempts, last_detection_time
-    init_camera()
+    capture.start()
     
-    frame_count = 0
-    failed_reads = 0
-    max_failed_reads = 15
+    # Mailbox 1 slot: viewer chậm luôn nhận frame mới nhất, không bị dồn frame cũ
+    mailbox = capture.subscribe(client)
+    
+    # Profile được yêu cầu là mức trần, ABR chọn bậc phù hợp với mạng của viewer
+    abr = AdaptiveBitrate(profile) if adaptive else None
+    mailbox.abr = abr
+    
+    # Lịch frame theo deadline, chỉ ngủ phần thời gian còn lại
+    pacer = FramePacer(profile.fps)
+    mailbox.pacer = pacer
     
     add_log("🎬 Video stream started with YOLO")
     
-    while True:
-        with camera_lock:
-            if camera is None or not camera.isOpened():
-                if camera_reconnect_attempts < 5:
-                    reconnect_camera()
-                time.sleep(1)
+    try:
+        while True:
+            # Newest frame from the shared capture thread
+            seq, frame = mailbox.take(timeout=1.0)
+            if frame is None:
                 continue
             
-            # Skip buffered frames
-            if USE_RTSP:
-                for _ in range(2):
-                    camera.grab()
+            if abr is not None:
+                profile = abr.profile
             
-            success, frame = camera.read()
-        
-        if not success:
-            failed_reads += 1
-            if failed_reads >= max_failed_reads:
-                add_log("⚠️ Mất kết nối. Đang kết nối lại...")
-                reconnect_camera()
-                failed_reads = 0
-            time.sleep(0.1)
-            continue
-        
-        failed_reads = 0
-        frame_count += 1
-        
-        # Resize for streaming
-        frame_display = cv2.resize(frame, (STREAM_WIDTH, STREAM_HEIGHT), 
-                                   interpolation=cv2.INTER_LINEAR)
-        
-        # Send to YOLO detection thread
-        current_time = time.time()
-        if (current_time - last_detection_time) >= DETECTION_INTERVAL:
-            if detection_queue.empty():
-                try:
-                    detection_queue.put_nowait(frame_display.copy())
-                except:
-                    pass
-        
-        # Draw detection boxes
-        if len(detection_boxes) > 0:
-            frame_display = draw_detections(frame_display)
-        
-        # Draw overlay
-        frame_display = draw_overlay(frame_display)
-        
-        # Encode
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
-        ret, buffer = cv2.imencode('.jpg', frame_display, encode_param)
-        
-        if not ret:
-            continue
+            # Encode once per frame, same bytes go to every viewer
+            frame_bytes = frame_cache.get(seq, profile, lambda: render_frame(seq, frame, profile, draw_boxes),
+                                          variant=draw_boxes)
+            if frame_bytes is None:
+                continue
             
-        frame_bytes = buffer.tobytes()
-        
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        
-        time.sleep(1.0 / TARGET_FPS)
+            # Time spent in yield = time the server needed to push the chunk to the socket
+            sent_at = time.monotonic()
+            yield frame_bytes
+            if abr is not None:
+                abr.on_sent(time.monotonic() - sent_at)
+            
+            pacer.wait(profile.fps)
+    finally:
+        capture.unsubscribe(mailbox)
 
 def update_sensors():
     """Background thread to simulate sensor updates"""
@@ -332,33 +402,81 @@ def update_sensors():
         time.sleep(2)
 
 # Routes
+def client_side_boxes(args):
+    """?boxes=client|server chọn nơi vẽ box cho một viewer, mặc định theo CLIENT_SIDE_BOXES"""
+    return args.get("boxes", "client" if CLIENT_SIDE_BOXES else "server") == "client"
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', client_boxes=client_side_boxes(request.args))
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(),
+    # ?profile=low|medium|full hoặc w, q, fps
+    profile = parse_profile(request.args, DEFAULT_PROFILE)
+    adaptive = ADAPTIVE_BITRATE and request.args.get("abr") != "0"
+    draw_boxes = not client_side_boxes(request.args)
+    return Response(generate_frames(profile, adaptive, request.remote_addr, draw_boxes),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/api/detections/stream')
+def detections_stream():
+    """Detection metadata (frame id, boxes, scores, track ids) cho dashboard tự vẽ box"""
+    return Response(detection_events(lambda: current_detections, TARGET_FPS),
+                    mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
 @app.route('/api/status')
 def get_status():
     return jsonify({
         "sensor_data": sensor_data,
         "detected_persons": detected_persons,
+        "detections": current_detections.to_list(),
         "is_recording": is_recording,
-        "system_online": True
+        "system_online": True,
+        "detection": detection_slot.stats(),
+        "detector_pool": detector_pool.stats() if detector_pool is not None else None
     })
 
 @app.route('/api/logs')
 def get_logs():
-    return jsonify({"logs": system_logs[:20]})
+    # ?since=<seq>: chỉ các entry mới hơn seq (mới nhất trước), không có: 20 entry mới nhất
+    since = request.args.get("since", type=int)
+    logs = system_logs.latest(20) if since is None else system_logs.since(since)[::-1]
+    # cursor = seq mới nhất đã trả về (gửi lại làm ?since=); last_seq nhỏ hơn since = server restart
+    cursor = logs[0]["seq"] if logs else since or 0
+    return jsonify({"logs": logs, "cursor": cursor, "last_seq": system_logs.last_seq})
+
+def dashboard_status():
+    """Values pushed by /api/events - only the ones that changed are sent"""
+    return {
+        "sensor_data": dict(sensor_data),
+        "detected_persons": detected_persons,
+        "is_recording": is_recording,
+    }
+
+@app.route('/api/events')
+def dashboard_stream():
+    """Sensor, person count and new log entries pushed as they change (thay cho poll status/logs)"""
+    return Response(dashboard_events(dashboard_status, system_logs),
+                    mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+@app.route('/api/stream_stats')
+def get_stream_stats():
+    return jsonify({
+        "capture": capture.stats(),
+        "viewers": capture.subscriber_stats(),
+        "encode_cache": frame_cache.stats(),
+        "tracker": tracker.stats() if tracker is not None else None,
+        "motion": motion_gate.stats() if motion_gate is not None else None,
+        "overlay": hud.stats(),
+        "logs": log_throttle.stats()
+    })
 
 if __name__ == '__main__':
     print("\n" + "="*70)
     print("  🚀 SAR-BOT PRO - YOLO PERSON DETECTION")
     print("="*70)
-    print(f"  🤖 Model: YOLOv8-Nano (Ultra Fast)")
+    print(f"  🤖 Model: {DETECTOR_MODEL} ({DETECTOR_BACKEND})")
     print(f"  📹 Stream: {STREAM_WIDTH}x{STREAM_HEIGHT} @ {TARGET_FPS}fps")
     print(f"  🔍 Detection: Every {DETECTION_INTERVAL} second")
     print(f"  📊 JPEG Quality: {JPEG_QUALITY}%")
@@ -368,6 +486,15 @@ if __name__ == '__main__':
     add_log("🚀 SAR-BOT PRO - YOLO MODE")
     add_log("🤖 YOLOv8 Person Detection: ACTIVE")
     
+    # Start shared capture thread
+    capture.start()
+    
+    # Start YOLO worker processes
+    if DETECTION_WORKERS > 0:
+        detector_pool = ProcessDetector(create_detector, DETECTOR_OPTIONS,
+                                        workers=DETECTION_WORKERS, on_result=apply_pool_result)
+        add_log(f"⚙️ YOLO detection: {DETECTION_WORKERS} worker processes")
+    
     # Start detection thread
     detection_worker = threading.Thread(target=detection_thread, daemon=True)
     detection_worker.start()
@@ -3,14 +3,19 @@ SAR-BOT PRO - ULTRA LIGHT MODE
 Tối ưu tối đa cho đường truyền chậm + Nhận diện người rõ ràng
 """
 
-from flask import Flask, render_template, Response, jsonify
+from flask import Flask, render_template, Response, jsonify, request
 import cv2
 import numpy as np
-from datetime import datetime
 import threading
 import time
 import random
-from queue import Queue
+from detection import HOG_PRESETS, DetectionSlot, Detections, HogEngine, ProcessDetector, roi_regions, tile_regions
+from stream import (AdaptiveBitrate, CaptureThread, EncodedFrameCache, FramePacer, StreamProfile,
+                    dashboard_events, detection_events, encode_jpeg_chunk, parse_profile, profile_size, FFMPEG_LOW_LATENCY_OPTIONS)
+from eventlog import DebugChannel, LogRing, LogThrottle
+from motion import MotionGate
+from overlay import OverlayCompositor
+from tracking import BoxTracker
 
 app = Flask(__name__)
 
@@ -24,17 +29,36 @@ STREAM_HEIGHT = 270     # Giảm xuống 270px
 DETECTION_INTERVAL = 2  # Detect mỗi 2 giây
 JPEG_QUALITY = 55       # Quality thấp
 TARGET_FPS = 12         # 12 FPS thay vì 15
+DETECTION_WORKERS = 2   # Số process chạy HOG song song (0 = chạy trong thread như cũ)
+ADAPTIVE_BITRATE = True  # Tự động tăng/giảm chất lượng theo tốc độ mạng của từng viewer
+CLIENT_SIDE_BOXES = False  # Stream frame sạch, dashboard vẽ box từ /api/detections/stream (?boxes=client|server)
+LOG_RATE_INTERVAL = 5.0  # Giây - log lặp lại trong khoảng này được gộp thành một entry (có số lần)
+DEBUG_LOG = False        # In debug mỗi frame (lấy mẫu, tối đa một dòng mỗi DEBUG_LOG_INTERVAL giây mỗi loại)
+DEBUG_LOG_INTERVAL = 1.0
+TRACKING = True  # Dời box theo người giữa hai lần detect (optical flow)
+MOTION_GATE = True      # Chỉ detect khi khung hình có chuyển động
+MOTION_INTERVAL = 0.5   # Có chuyển động: detect nhanh hơn DETECTION_INTERVAL
+STATIC_INTERVAL = 10    # Đứng yên: vẫn detect mỗi 10 giây để xác nhận
+ROI_DETECTION = True    # Chỉ detect trong vùng chuyển động / vùng đang track
+ROI_FULL_FRAME_INTERVAL = 5  # Giây - định kỳ detect cả frame
+ROI_MIN_SIZE = (80, 135)  # Crop nhỏ nhất trên frame detection, HOG window là 64x128
+TILED_DETECTION = False  # Detect trên frame lớn hơn, chia tile chồng nhau - bắt người ở xa
+TILED_DETECTION_SIZE = (960, 540)  # Frame detection khi bật tile (thay cho 240x135)
+TILE_SIZE = (480, 270)   # Người cao hơn tile bị cắt đôi - giữ khoảng nửa frame
+TILE_OVERLAP = 0.25      # Tỉ lệ chồng giữa hai tile kề nhau
 
 # Global variables
-camera = None
-camera_lock = threading.Lock()
-system_logs = []
+system_logs = LogRing(capacity=200)
+log_throttle = LogThrottle(system_logs, interval=LOG_RATE_INTERVAL)
+debug = DebugChannel(DEBUG_LOG, interval=DEBUG_LOG_INTERVAL)
 detected_persons = 0
-detection_boxes = []
+current_detections = Detections()  # Snapshot bất biến, thay cả object khi có kết quả mới
 last_detection_time = 0
 is_recording = False
-camera_reconnect_attempts = 0
 detection_active = False  # Flag để hiển thị detection status
+last_full_detection = 0  # Lần cuối detect cả frame (ROI mode)
+latest_result_id = 0      # Frame id của kết quả detection đang hiển thị
+detector_pool = None      # ProcessDetector khi DETECTION_WORKERS > 0
 
 # Sensor data
 sensor_data = {
@@ -46,88 +70,125 @@ sensor_data = {
     "battery_level": 84
 }
 
-# Initialize HOG descriptor
-hog = cv2.HOGDescriptor()
-hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-
-# Frame queue for detection
-detection_queue = Queue(maxsize=1)
-
-def add_log(message):
-    """Add a new log entry"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    system_logs.insert(0, {"time": timestamp, "message": message})
-    if len(system_logs) > 50:
-        system_logs.pop()
-
-def init_camera():
-    """Initialize camera"""
-    global camera, camera_reconnect_attempts
-    with camera_lock:
-        if camera is None:
-            try:
-                if USE_RTSP:
-                    add_log("🔌 Đang kết nối EZVIZ camera...")
-                    
-                    import os
-                    os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = (
-                        "rtsp_transport;tcp|"
-                        "fflags;nobuffer|"
-                        "flags;low_delay|"
-                        "framedrop;1|"
-                        "max_delay;0"
-                    )
-                    
-                    camera = cv2.VideoCapture(RTSP_URL, cv2.CAP_FFMPEG)
-                    
-                    # Ultra low latency
-                    camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                    camera.set(cv2.CAP_PROP_FPS, TARGET_FPS)
-                    camera.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 5000)
-                    camera.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, 5000)
-                else:
-                    add_log("🔌 Đang kết nối webcam local...")
-                    camera = cv2.VideoCapture(0)
-                    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 360)
-                
-                if camera.isOpened():
-                    add_log("✅ Camera đã kết nối - ULTRA LIGHT MODE")
-                    add_log(f"📹 Stream: {STREAM_WIDTH}x{STREAM_HEIGHT} @ {TARGET_FPS}fps")
-                    camera_reconnect_attempts = 0
-                else:
-                    add_log("❌ LỖI: Không thể kết nối camera")
-                    camera = None
-                    
-            except Exception as e:
-                add_log(f"❌ LỖI: {str(e)}")
-                camera = None
-
-def detect_persons_async(frame_small):
-    """Detect persons - optimized & sensitive"""
-    global detected_persons, detection_boxes, detection_active
+# HOG detection - preset "fast" | "balanced" | "sensitive" (đổi lúc chạy qua /api/hog_preset)
+HOG_PRESET = "balanced"
+HOG_PERSON_HEIGHT = (0.4, 1.0)  # Chiều cao người / chiều cao frame theo vị trí gắn camera
+HOG_MAX_UPSCALE = 1.0           # > 1 phóng to frame để bắt người nhỏ hơn cửa sổ 128 px (chậm hơn ~10-20x)
+
+# Initialize HOG engine (dùng khi chạy trong thread)
+hog = HogEngine(HOG_PRESET, HOG_PERSON_HEIGHT, max_upscale=HOG_MAX_UPSCALE)
+
+# Latest-frame handoff to the detection thread
+detection_slot = DetectionSlot()
+tracker = BoxTracker() if TRACKING else None
+motion_gate = MotionGate(MOTION_INTERVAL, STATIC_INTERVAL) if MOTION_GATE else None
+
+# Detection scale (rất nhỏ để nhanh)
+DETECTION_WIDTH = 240
+DETECTION_HEIGHT = 135
+
+def add_log(message, key=None):
+    """Add a new log entry - repeats of the same key are rate-limited and coalesced"""
+    log_throttle.log(message, key)
+
+def on_camera_connect():
+    """Log camera connection"""
+    add_log("✅ Camera đã kết nối - ULTRA LIGHT MODE")
+    add_log(f"📹 Stream: {STREAM_WIDTH}x{STREAM_HEIGHT} @ {TARGET_FPS}fps")
+
+def plan_regions(frame_w, frame_h):
+    """Vùng cần detect: vùng chuyển động + người đang track; None = cả frame
+
+    TILED_DETECTION: lần detect cả frame chạy theo tile, box trùng ở vùng
+    chồng được gộp bằng NMS trong HogEngine.
+    """
+    global last_full_detection
+    
+    if ROI_DETECTION and time.time() - last_full_detection < ROI_FULL_FRAME_INTERVAL:
+        boxes = current_detections.scaled_to(frame_w, frame_h).tolist()
+        if motion_gate is not None:
+            boxes += motion_gate.regions((frame_w, frame_h))
+        regions = roi_regions(boxes, (frame_w, frame_h), min_size=ROI_MIN_SIZE)
+        if regions is not None:
+            return regions
+    
+    # Định kỳ detect cả frame để bắt người mới xuất hiện ngoài các vùng
+    last_full_detection = time.time()
+    if TILED_DETECTION:
+        # Thêm cả frame: ở level thu nhỏ tile nhỏ hơn cửa sổ 64x128 bị bỏ qua, người đứng gần chỉ bắt được ở đây
+        return tile_regions((frame_w, frame_h), TILE_SIZE, TILE_OVERLAP) + [(0, 0, frame_w, frame_h)]
+    return None
+
+def submit_detection(seq, frame):
+    """Called by the capture thread for every new frame - feed HOG thread"""
+    global current_detections
+    
+    since_last = time.time() - last_detection_time
+    if motion_gate is not None:
+        # Cảnh tĩnh: bỏ qua detection, có chuyển động: detect sớm hơn
+        motion_gate.update(frame)
+        due = motion_gate.due(since_last)
+    else:
+        due = since_last >= DETECTION_INTERVAL
+    offer = due and detection_slot.idle()
+    
+    # Dời box theo người trên mọi frame, không đợi lần detect sau
+    if tracker is not None:
+        tracked = tracker.advance(seq, frame, keep=offer)
+        if tracked is not None:
+            current_detections = tracked
+    
+    if offer:
+        # 240x135: người xa chỉ vài pixel, nhỏ hơn cửa sổ HOG 64x128 -> bật tile để detect ở frame lớn
+        size = TILED_DETECTION_SIZE if TILED_DETECTION else (DETECTION_WIDTH, DETECTION_HEIGHT)
+        frame_detect = cv2.resize(frame, size)
+        detection_slot.offer(frame_detect, seq, regions=plan_regions(*size))
+
+# Single capture thread shared by every /video_feed viewer
+capture = CaptureThread(
+    RTSP_URL,
+    use_rtsp=USE_RTSP,
+    target_fps=TARGET_FPS,
+    ffmpeg_options=FFMPEG_LOW_LATENCY_OPTIONS + "|max_delay;0",
+    open_timeout_ms=5000,
+    log=add_log,
+    on_connect=on_camera_connect,
+    on_frame=submit_detection,
+)
+
+def apply_detections(frame_id, result):
+    """Publish HOG result - results from worker processes may arrive out of order"""
+    global detected_persons, current_detections, latest_result_id
+    
+    if frame_id is not None and frame_id < latest_result_id:
+        return
+    latest_result_id = frame_id or latest_result_id
+    
+    if tracker is not None:
+        current_detections = tracker.update(result.with_frame_id(frame_id))
+    else:
+        current_detections = result.with_frame_id(frame_id)
+    detected_persons = len(result)
+    
+    if detected_persons > 0:
+        add_log(f"👤 AI VISION: PHÁT HIỆN {detected_persons} NGƯỜI!", key="detection")
+        debug("detect", "Detected %d persons with boxes: %s", detected_persons, current_detections.boxes)
+    else:
+        debug("detect", "No person detected in this frame")
+
+def detect_persons_async(frame_small, frame_id=None, regions=None):
+    """Detect persons - optimized & sensitive (regions != None: chỉ detect trong các crop đó)"""
+    global detection_active
     
     detection_active = True
     
     try:
-        # HOG detection với settings NHẠY HƠN để dễ phát hiện người
-        boxes, weights = hog.detectMultiScale(
-            frame_small,
-            winStride=(8, 8),      # Giảm từ 16 xuống 8 = nhạy hơn
-            padding=(8, 8),
-            scale=1.05,            # Giảm từ 1.15 xuống 1.05 = nhiều scale hơn
-            hitThreshold=0,        # Giảm từ 0.5 xuống 0 = nhạy nhất
-            finalThreshold=1.0     # Giảm từ 2.0 xuống 1.0 = dễ detect hơn
-        )
-        
-        detected_persons = len(boxes)
-        detection_boxes = [(box, weight) for box, weight in zip(boxes, weights)]
-        
-        if detected_persons > 0:
-            add_log(f"👤 AI VISION: PHÁT HIỆN {detected_persons} NGƯỜI!")
-            print(f"[DEBUG] Detected {detected_persons} persons with boxes: {boxes}")
+        if detector_pool is not None:
+            # Chạy trong worker process, kết quả về qua apply_detections
+            detector_pool.submit(frame_id, frame_small, regions=regions)
         else:
-            print(f"[DEBUG] No person detected in this frame")
+            # Pyramid dựng một lần, dùng chung cho mọi vùng / tile
+            apply_detections(frame_id, hog.detect_regions(frame_small, regions))
             
     except Exception as e:
         print(f"Detection error: {e}")
@@ -142,25 +203,26 @@ def detection_thread():
     
     while True:
         try:
-            if not detection_queue.empty():
-                frame_small = detection_queue.get()
-                detect_persons_async(frame_small)
+            log_throttle.flush()   # Ghi các log lặp lại đang chờ gộp
+            # Block until the capture thread offers a frame - no polling
+            batch = detection_slot.take_batch(timeout=1.0)
+            if not batch:
+                continue
+            _, frame_id, frame_small, regions = batch[0]
+            try:
+                detect_persons_async(frame_small, frame_id, regions)
+            finally:
                 last_detection_time = time.time()
-            time.sleep(0.1)
+                detection_slot.done()
         except Exception as e:
             print(f"Detection thread error: {e}")
             time.sleep(1)
 
-def draw_detections(frame, scale_x, scale_y):
+def draw_detections(frame, detections):
     """Draw detection boxes - MÀU XANH LÁ NEON CỰC RÕ"""
-    print(f"[DRAW] Drawing {len(detection_boxes)} detection boxes")
-    
-    for idx, ((x, y, w, h), weight) in enumerate(detection_boxes):
-        # Scale to display size
-        x, y, w, h = int(x * scale_x), int(y * scale_y), int(w * scale_x), int(h * scale_y)
-        
-        print(f"[DRAW] Person #{idx+1} at ({x},{y}) size ({w}x{h})")
-        
+    # Scale to display size - cả mảng một lần
+    boxes = detections.scaled_to(frame.shape[1], frame.shape[0])
+    for idx, ((x, y, w, h), track_id) in enumerate(zip(boxes.tolist(), detections.track_ids.tolist())):
         # KHUNG CHÍNH - MÀU XANH LÁ NEON CỰC RÕ
         cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 4)  # GREEN, thickness 4
         
@@ -186,7 +248,8 @@ def draw_detections(frame, scale_x, scale_y):
         cv2.line(frame, (x + w, y + h), (x + w, y + h - corner_len), corner_color, thickness)
         
         # LABEL LỚN với background VÀNG
-        label = f"PERSON #{idx+1}"
+        # ID của tracker giữ nguyên khi người di chuyển
+        label = f"PERSON #{track_id if track_id > 0 else idx + 1}"
         font = cv2.FONT_HERSHEY_SIMPLEX
         font_scale = 1.0  # Tăng size
         font_thickness = 3
@@ -206,13 +269,14 @@ def draw_detections(frame, scale_x, scale_y):
     
     return frame
 
-def draw_overlay(frame):
-    """Draw overlay với detection counter"""
+def draw_hud(frame, state):
+    """Draw HUD với detection counter - chỉ gọi khi nội dung đổi (xem OverlayCompositor)"""
+    persons, active = state
     h, w = frame.shape[:2]
     
     # Detection counter ở góc trái trên
-    if detected_persons > 0:
-        counter_text = f"DETECTED: {detected_persons} PERSON(S)"
+    if persons > 0:
+        counter_text = f"DETECTED: {persons} PERSON(S)"
         text_size = cv2.getTextSize(counter_text, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0]
         
         # Background
@@ -221,7 +285,7 @@ def draw_overlay(frame):
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
     
     # Detection status indicator
-    if detection_active:
+    if active:
         cv2.circle(frame, (w - 30, 30), 10, (0, 255, 0), -1)  # Green = detecting
         cv2.putText(frame, "AI", (w - 45, 37), 
                     cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
@@ -242,101 +306,86 @@ def draw_overlay(frame):
     
     return frame
 
-def reconnect_camera():
-    """Reconnect camera"""
-    global camera, camera_reconnect_attempts
+# HUD vẽ sẵn theo độ phân giải + nội dung, mỗi frame chỉ copy các pixel của HUD
+hud = OverlayCompositor(draw_hud)
+
+def draw_overlay(frame):
+    """Composite the cached HUD onto the frame"""
+    active = detection_active or (detector_pool is not None and detector_pool.in_flight > 0)
+    return hud.apply(frame, (detected_persons, active))
+
+# Encoded frames shared by all viewers on the same profile
+DEFAULT_PROFILE = StreamProfile(STREAM_WIDTH, STREAM_HEIGHT, JPEG_QUALITY, TARGET_FPS)
+frame_cache = EncodedFrameCache(max_entries=16)
+
+def render_frame(seq, frame, profile, draw_boxes=True):
+    """Resize, annotate and encode one captured frame for a stream profile
+
+    draw_boxes=False: box do dashboard vẽ trên canvas, frame chỉ có HUD.
+    """
+    # Resize frame for streaming (critical!)
+    width, height = profile_size(profile, frame.shape[1], frame.shape[0])
+    frame_display = cv2.resize(frame, (width, height), 
+                               interpolation=cv2.INTER_LINEAR)
     
-    with camera_lock:
-        if camera is not None:
-            camera.release()
-            camera = None
-        
-        camera_reconnect_attempts += 1
-        add_log(f"🔄 Thử kết nối lại... (lần {camera_reconnect_attempts})")
-        
-    time.sleep(2)
-    init_camera()
+    # Draw detection boxes - LUÔN LUÔN vẽ nếu có
+    detections = current_detections
+    if draw_boxes and len(detections) > 0:
+        frame_display = draw_detections(frame_display, detections)
+        debug("draw", "Drawing %d boxes on frame: %s", len(detections), detections.boxes)
+    
+    # Draw overlay
+    frame_display = draw_overlay(frame_display)
+    
+    # Encode with profile quality
+    chunk = encode_jpeg_chunk(frame_display, profile.quality)
+    # Slot ring bị ghi đè trong lúc đọc: bỏ frame thay vì gửi ảnh bị xé
+    if not capture.is_intact(seq, frame):
+        return None
+    return chunk
 
-def generate_frames():
+def generate_frames(profile=DEFAULT_PROFILE, adaptive=ADAPTIVE_BITRATE, client="", draw_boxes=True):
     """Generate video frames - ULTRA OPTIMIZED"""
-    global camera, camera_reconnect_attempts, last_detection_time
-    init_camera()
+    capture.start()
     
-    frame_count = 0
-    failed_reads = 0
-    max_failed_reads = 15
+    # Mailbox 1 slot: viewer chậm luôn nhận frame mới nhất, không bị dồn frame cũ
+    mailbox = capture.subscribe(client)
     
-    # Detection scale (rất nhỏ để nhanh)
-    detection_width = 240
-    detection_height = 135
+    # Profile được yêu cầu là mức trần, ABR chọn bậc phù hợp với mạng của viewer
+    abr = AdaptiveBitrate(profile) if adaptive else None
+    mailbox.abr = abr
+    
+    # Lịch frame theo deadline, chỉ ngủ phần thời gian còn lại
+    pacer = FramePacer(profile.fps)
+    mailbox.pacer = pacer
     
     add_log("🎬 Video stream started")
     
-    while True:
-        with camera_lock:
-            if camera is None or not camera.isOpened():
-                if camera_reconnect_attempts < 5:
-                    reconnect_camera()
-                time.sleep(1)
+    try:
+        while True:
+            # Newest frame from the shared capture thread
+            seq, frame = mailbox.take(timeout=1.0)
+            if frame is None:
                 continue
             
-            # Skip nhiều buffered frames để giảm lag
-            if USE_RTSP:
-                for _ in range(3):  # Skip 3 frames
-                    camera.grab()
+            if abr is not None:
+                profile = abr.profile
             
-            success, frame = camera.read()
-        
-        if not success:
-            failed_reads += 1
-            if failed_reads >= max_failed_reads:
-                add_log("⚠️ Mất kết nối. Đang kết nối lại...")
-                reconnect_camera()
-                failed_reads = 0
-            time.sleep(0.1)
-            continue
-        
-        failed_reads = 0
-        frame_count += 1
-        
-        # Resize frame for streaming (critical!)
-        frame_display = cv2.resize(frame, (STREAM_WIDTH, STREAM_HEIGHT), 
-                                   interpolation=cv2.INTER_LINEAR)
-        
-        # Send frame to detection thread
-        current_time = time.time()
-        if (current_time - last_detection_time) >= DETECTION_INTERVAL:
-            if detection_queue.empty():
-                frame_detect = cv2.resize(frame, (detection_width, detection_height))
-                try:
-                    detection_queue.put_nowait(frame_detect)
-                except:
-                    pass
-        
-        # Draw detection boxes - LUÔN LUÔN vẽ nếu có
-        if len(detection_boxes) > 0:
-            scale_x = STREAM_WIDTH / detection_width
-            scale_y = STREAM_HEIGHT / detection_height
-            frame_display = draw_detections(frame_display, scale_x, scale_y)
-            print(f"[DEBUG] Drawing {len(detection_boxes)} boxes on frame")
-        
-        # Draw overlay
-        frame_display = draw_overlay(frame_display)
-        
-        # Encode with low quality
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
-        ret, buffer = cv2.imencode('.jpg', frame_display, encode_param)
-        
-        if not ret:
-            continue
+            # Encode once per frame, same bytes go to every viewer
+            frame_bytes = frame_cache.get(seq, profile, lambda: render_frame(seq, frame, profile, draw_boxes),
+                                          variant=draw_boxes)
+            if frame_bytes is None:
+                continue
             
-        frame_bytes = buffer.tobytes()
-        
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        
-        # 12 FPS
-        time.sleep(1.0 / TARGET_FPS)
+            # Time spent in yield = time the server needed to push the chunk to the socket
+            sent_at = time.monotonic()
+            yield frame_bytes
+            if abr is not None:
+                abr.on_sent(time.monotonic() - sent_at)
+            
+            pacer.wait(profile.fps)
+    finally:
+        capture.unsubscribe(mailbox)
 
 def update_sensors():
     """Background thread to simulate sensor updates"""
@@ -349,31 +398,96 @@ def update_sensors():
         time.sleep(2)
 
 # Routes
+def client_side_boxes(args):
+    """?boxes=client|server chọn nơi vẽ box cho một viewer, mặc định theo CLIENT_SIDE_BOXES"""
+    return args.get("boxes", "client" if CLIENT_SIDE_BOXES else "server") == "client"
+
 @app.route('/')
 def index():
     """Main dashboard page"""
-    return render_template('index.html')
+    return render_template('index.html', client_boxes=client_side_boxes(request.args))
 
 @app.route('/video_feed')
 def video_feed():
-    """Video streaming route"""
-    return Response(generate_frames(),
+    """Video streaming route - ?profile=low|medium|full hoặc w, q, fps"""
+    profile = parse_profile(request.args, DEFAULT_PROFILE)
+    adaptive = ADAPTIVE_BITRATE and request.args.get("abr") != "0"
+    draw_boxes = not client_side_boxes(request.args)
+    return Response(generate_frames(profile, adaptive, request.remote_addr, draw_boxes),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/api/detections/stream')
+def detections_stream():
+    """Detection metadata (frame id, boxes, scores, track ids) cho dashboard tự vẽ box"""
+    return Response(detection_events(lambda: current_detections, TARGET_FPS),
+                    mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
 @app.route('/api/status')
 def get_status():
     """Get system status"""
     return jsonify({
         "sensor_data": sensor_data,
         "detected_persons": detected_persons,
+        "detections": current_detections.to_list(),
         "is_recording": is_recording,
-        "system_online": True
+        "system_online": True,
+        "detection": detection_slot.stats(),
+        "detector_pool": detector_pool.stats() if detector_pool is not None else None
     })
 
 @app.route('/api/logs')
 def get_logs():
     """Get system logs"""
-    return jsonify({"logs": system_logs[:20]})
+    # ?since=<seq>: chỉ các entry mới hơn seq (mới nhất trước), không có: 20 entry mới nhất
+    since = request.args.get("since", type=int)
+    logs = system_logs.latest(20) if since is None else system_logs.since(since)[::-1]
+    # cursor = seq mới nhất đã trả về (gửi lại làm ?since=); last_seq nhỏ hơn since = server restart
+    cursor = logs[0]["seq"] if logs else since or 0
+    return jsonify({"logs": logs, "cursor": cursor, "last_seq": system_logs.last_seq})
+
+def dashboard_status():
+    """Values pushed by /api/events - only the ones that changed are sent"""
+    return {
+        "sensor_data": dict(sensor_data),
+        "detected_persons": detected_persons,
+        "is_recording": is_recording,
+    }
+
+@app.route('/api/events')
+def dashboard_stream():
+    """Sensor, person count and new log entries pushed as they change (thay cho poll status/logs)"""
+    return Response(dashboard_events(dashboard_status, system_logs),
+                    mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+@app.route('/api/stream_stats')
+def get_stream_stats():
+    """Per-viewer stream statistics"""
+    return jsonify({
+        "capture": capture.stats(),
+        "viewers": capture.subscriber_stats(),
+        "encode_cache": frame_cache.stats(),
+        "tracker": tracker.stats() if tracker is not None else None,
+        "motion": motion_gate.stats() if motion_gate is not None else None,
+        "overlay": hud.stats(),
+        # Với worker processes, HOG chạy trong các process đó: số liệu ở "detector_pool" (/api/status)
+        "hog": hog.stats() if detector_pool is None else None,
+        "logs": log_throttle.stats()
+    })
+
+@app.route('/api/hog_preset', methods=['GET', 'POST'])
+def hog_preset():
+    """Đổi preset HOG lúc chạy - POST {"preset": "fast", "person_height": [0.3, 1.0]}"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            hog.configure(data.get("preset"), data.get("person_height"))
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": str(e)}), 400
+        if detector_pool is not None:
+            detector_pool.configure(preset=hog.preset, person_height=hog.person_height)
+        add_log(f"🔧 HOG preset: {hog.preset}")
+    return jsonify({"preset": hog.preset, "person_height": list(hog.person_height),
+                    "presets": HOG_PRESETS})
 
 if __name__ == '__main__':
     print("\n" + "="*70)
@@ -393,6 +507,16 @@ if __name__ == '__main__':
     add_log("🚀 Hệ thống khởi động - ULTRA LIGHT MODE")
     add_log("👤 AI Nhận diện người: ENABLED")
     
+    # Start shared capture thread
+    capture.start()
+    
+    # Start HOG worker processes (tránh tranh GIL với luồng stream)
+    if DETECTION_WORKERS > 0:
+        hog_kwargs = dict(preset=HOG_PRESET, person_height=HOG_PERSON_HEIGHT, max_upscale=HOG_MAX_UPSCALE)
+        detector_pool = ProcessDetector(HogEngine, hog_kwargs,
+                                        workers=DETECTION_WORKERS, on_result=apply_detections)
+        add_log(f"⚙️ HOG detection: {DETECTION_WORKERS} worker processes")
+    
     # Start detection thread
     detection_worker = threading.Thread(target=detection_thread, daemon=True)
     detection_worker.start()
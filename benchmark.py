@@ -0,0 +1,235 @@
+"""
+SAR-BOT PRO - Detection Benchmark
+Đo tốc độ và độ chính xác của các detector trên một clip quay tại chỗ
+
+    python benchmark.py hog clip.mp4 --size 240x135 --person-height 0.4 1.0
+    python benchmark.py quantize clip.mp4 yolov8n.onnx        # -> yolov8n_int8.onnx
+    python benchmark.py onnx clip.mp4 yolov8n.onnx            # FP32 vs INT8: AP50 / latency
+"""
+
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from detection import HOG_PRESETS, Detections, HogEngine, OnnxDetector, int8_model_path
+from tracking import iou_matrix
+
+
+def read_frames(path, count, size=None, step=5):
+    """Up to count frames from a video file, one every step frames"""
+    capture = cv2.VideoCapture(path)
+    frames = []
+    index = 0
+    while len(frames) < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        if index % step == 0:
+            frames.append(cv2.resize(frame, size) if size else frame)
+        index += 1
+    capture.release()
+    return frames
+
+
+def recall(found, reference, iou_threshold=0.5):
+    """Fraction of reference boxes matched by a found box with IoU >= iou_threshold"""
+    total = sum(len(r) for r in reference)
+    if total == 0:
+        return None
+    matched = 0
+    for f, r in zip(found, reference):
+        if len(f) and len(r):
+            matched += np.count_nonzero(iou_matrix(r.boxes, f.boxes).max(axis=1) >= iou_threshold)
+    return matched / total
+
+
+def average_precision(found, truth, iou_threshold=0.5):
+    """AP at one IoU threshold (all-point interpolation, như VOC) of detections vs ground truth"""
+    total = sum(len(t) for t in truth)
+    if total == 0:
+        return None
+
+    scored = []   # (score, true positive?)
+    for f, t in zip(found, truth):
+        order = np.argsort(-f.scores)
+        iou = iou_matrix(f.boxes[order], t.boxes) if len(f) and len(t) else np.zeros((len(f), 0))
+        matched = np.zeros(len(t), dtype=bool)
+        for row, index in enumerate(order):
+            hit = False
+            if iou.shape[1]:
+                candidates = np.where(matched, -1.0, iou[row])
+                best = int(np.argmax(candidates))
+                if candidates[best] >= iou_threshold:
+                    matched[best] = hit = True
+            scored.append((f.scores[index], hit))
+    if not scored:
+        return 0.0
+
+    scored.sort(key=lambda item: -item[0])
+    hits = np.array([hit for _, hit in scored])
+    true_positives = np.cumsum(hits)
+    recall_curve = np.concatenate([[0.0], true_positives / total, [1.0]])
+    precision_curve = np.concatenate([[0.0], true_positives / np.arange(1, len(hits) + 1), [0.0]])
+    precision_curve = np.maximum.accumulate(precision_curve[::-1])[::-1]
+    return float(np.sum(np.diff(recall_curve) * precision_curve[1:]))
+
+
+def video_size(path):
+    """(width, height) of the clip as recorded"""
+    capture = cv2.VideoCapture(path)
+    size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    capture.release()
+    return size
+
+
+def load_labels(path, frame_count, frame_size, source_size=None, step=5):
+    """Ground truth from JSON {"<video frame number>": [[x, y, w, h], ...]} for the sampled frames.
+
+    Labels are in the clip's own pixels (source_size); with --size the
+    frames are resized, so the boxes are scaled to frame_size too.
+    """
+    with open(path) as f:
+        labels = json.load(f)
+    scale = np.ones(4)
+    if source_size is not None:
+        sx, sy = frame_size[0] / source_size[0], frame_size[1] / source_size[1]
+        scale = np.array([sx, sy, sx, sy])
+    truth = []
+    for i in range(frame_count):
+        boxes = np.array(labels.get(str(i * step), []), dtype=np.float64).reshape(-1, 4) * scale
+        truth.append(Detections(boxes, np.ones(len(boxes)), frame_size=frame_size))
+    return truth
+
+
+def run(detect, frames):
+    """Detect every frame; returns (results, ms per frame)"""
+    detect(frames[0])   # warm-up
+    started = time.perf_counter()
+    results = [detect(frame) for frame in frames]
+    return results, (time.perf_counter() - started) * 1000 / len(frames)
+
+
+def benchmark_hog(frames, person_height, max_upscale=1.0, reference_preset="sensitive"):
+    """Every HOG preset on the same frames; recall is measured against reference_preset"""
+    rows = {}
+    for preset in HOG_PRESETS:
+        engine = HogEngine(preset, person_height, max_upscale=max_upscale)
+        results, ms = run(engine, frames)
+        rows[preset] = (results, ms, engine.levels)
+
+    reference = rows[reference_preset][0]
+    print(f"{'preset':<12}{'ms/frame':>10}{'levels':>8}{'boxes/frame':>13}{'recall':>8}")
+    for preset, (results, ms, levels) in rows.items():
+        value = recall(results, reference)
+        recall_text = "-" if value is None else f"{value:.2f}"
+        boxes = sum(len(r) for r in results) / len(results)
+        print(f"{preset:<12}{ms:>10.1f}{levels:>8}{boxes:>13.2f}{recall_text:>8}")
+    print(f"(recall so với preset '{reference_preset}' - preset nhạy nhất)")
+
+
+def benchmark_onnx(frames, model_paths, runtime, labels=None):
+    """FP32 vs INT8 (or any ONNX models): latency and AP50 on the same frames.
+
+    Without labels the first model's detections with score >= 0.5 are the
+    ground truth, so AP50 then measures how far quantization drifts from FP32.
+    """
+    rows = []
+    for path in model_paths:
+        # conf thấp để đường precision/recall đủ điểm, giống cách tính mAP của YOLO
+        detector = OnnxDetector(path, conf=0.01, runtime=runtime)
+        results, ms = run(detector, frames)
+        rows.append((path, results, ms, os.path.getsize(path) / 1e6))
+
+    if labels is not None:
+        truth, truth_name = labels, "labels"
+    else:
+        truth = [Detections(r.boxes[r.scores >= 0.5], r.scores[r.scores >= 0.5], frame_size=r.frame_size)
+                 for r in rows[0][1]]
+        truth_name = f"{rows[0][0]} (score >= 0.5)"
+
+    print(f"{'model':<28}{'MB':>7}{'ms/frame':>10}{'AP50':>8}")
+    for path, results, ms, size_mb in rows:
+        ap = average_precision(results, truth)
+        ap_text = "-" if ap is None else f"{ap:.3f}"
+        print(f"{os.path.basename(path):<28}{size_mb:>7.1f}{ms:>10.1f}{ap_text:>8}")
+    print(f"(ground truth: {truth_name}, runtime: {runtime})")
+
+
+def quantize(model_path, frames, output_path):
+    """Static INT8 quantization of an ONNX model, calibrated on frames from the local clip"""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    detector = OnnxDetector(model_path, runtime="onnxruntime")
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self._frames = iter(frames)
+
+        def get_next(self):
+            frame = next(self._frames, None)
+            if frame is None:
+                return None
+            blob, _ = detector.preprocess([frame])
+            return {detector._input_name: blob}
+
+    # QDQ + per-channel: định dạng onnxruntime chạy nhanh nhất trên CPU, giữ accuracy tốt hơn per-tensor
+    quantize_static(model_path, output_path, FrameReader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    print(f"INT8 model: {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB, "
+          f"FP32 {os.path.getsize(model_path) / 1e6:.1f} MB)")
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detectors on a local clip")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    hog = commands.add_parser("hog", help="So sánh các preset HOG")
+    onnx = commands.add_parser("onnx", help="So sánh model ONNX FP32 và bản INT8")
+    quant = commands.add_parser("quantize", help="Tạo bản INT8 của model ONNX")
+    for command in (hog, onnx, quant):
+        command.add_argument("video", help="Clip quay từ camera tại chỗ")
+        command.add_argument("--frames", type=int, default=50)
+        command.add_argument("--size", type=parse_size, default=None, help="WxH, mặc định giữ nguyên")
+
+    hog.add_argument("--person-height", type=float, nargs=2, default=(0.25, 1.0),
+                     metavar=("MIN", "MAX"), help="Chiều cao người / chiều cao frame")
+    hog.add_argument("--max-upscale", type=float, default=1.0, help="> 1 để phóng to frame, bắt người nhỏ")
+
+    onnx.add_argument("model", help="Model FP32, bản INT8 cạnh nó được thêm vào nếu có")
+    onnx.add_argument("--compare", nargs="*", default=[], help="Thêm model khác để so sánh")
+    onnx.add_argument("--runtime", choices=["onnxruntime", "dnn"], default="onnxruntime")
+    onnx.add_argument("--labels", help='JSON {"<số frame>": [[x, y, w, h], ...]}, mặc định so với FP32')
+
+    quant.add_argument("model")
+    quant.add_argument("--output", help="Mặc định <model>_int8.onnx")
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.frames, args.size)
+    if not frames:
+        parser.error(f"Không đọc được frame từ {args.video}")
+    height, width = frames[0].shape[:2]
+    print(f"{len(frames)} frames {width}x{height}")
+
+    if args.command == "hog":
+        benchmark_hog(frames, args.person_height, args.max_upscale)
+    elif args.command == "quantize":
+        quantize(args.model, frames, args.output or int8_model_path(args.model))
+    else:
+        models = [args.model]
+        if os.path.exists(int8_model_path(args.model)):
+            models.append(int8_model_path(args.model))
+        labels = load_labels(args.labels, len(frames), (width, height), video_size(args.video)) if args.labels else None
+        benchmark_onnx(frames, models + args.compare, args.runtime, labels)
+
+
+if __name__ == "__main__":
+    main()
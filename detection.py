@@ -0,0 +1,911 @@
+"""
+SAR-BOT PRO - Detection Pipeline Helpers
+Chuyển frame sang detection worker theo kiểu event-driven, chỉ giữ frame mới nhất
+"""
+
+import atexit
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+DEFAULT_SOURCE = "main"
+RETIRED_BUFFER_NAMES = 16   # Số tên block đã unlink (buffer pool, ring cũ) được gửi kèm mỗi job
+
+
+class DetectionSlot:
+    """Latest-frame-only handoff between capture threads and a detection worker.
+
+    Each source (camera) has one slot: offer() never blocks and replaces a
+    frame the worker has not picked up yet; take() blocks on a condition
+    variable, so detection starts the moment a frame is offered instead of
+    on the next poll. take_batch() waits a short window for other sources
+    so one inference call can cover several cameras.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._items = OrderedDict()
+        self._busy = set()
+        self._sources = set()
+
+        self.offered = 0
+        self.replaced = 0
+        self.taken = 0
+        self.batches = 0
+        self.avg_batch = 0.0
+        self.last_wait_ms = 0.0
+        self.avg_wait_ms = 0.0
+
+    def idle(self, source=DEFAULT_SOURCE):
+        """True when the source has nothing queued and is not being detected"""
+        return source not in self._items and source not in self._busy
+
+    def offer(self, frame, frame_id=None, source=DEFAULT_SOURCE, regions=None):
+        """Hand a frame to the worker; returns the id of the frame it replaced, if any.
+
+        regions = [(x, y, w, h)] to detect in, None for the whole frame.
+        """
+        replaced_id = None
+        with self._cond:
+            if source in self._items:
+                self.replaced += 1
+                replaced_id = self._items.pop(source)[0]
+            self._items[source] = (frame_id, frame, regions, time.monotonic())
+            self._sources.add(source)
+            self.offered += 1
+            self._cond.notify()
+        return replaced_id
+
+    def take_batch(self, timeout=None, max_items=1, window=0.0):
+        """Block until a frame is offered, then return up to max_items
+        [(source, frame_id, frame, regions)]; the worker is busy until done().
+
+        After the first frame arrives, waits at most `window` seconds
+        (counted from that frame's offer) for the other known sources to
+        fill the batch, so a single camera never waits. An empty list means
+        timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return []
+            target = min(max_items, len(self._sources))
+            if window > 0 and len(self._items) < target:
+                oldest = next(iter(self._items.values()))[3]
+                remaining = oldest + window - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait_for(lambda: len(self._items) >= target, remaining)
+
+            now = time.monotonic()
+            batch = []
+            while self._items and len(batch) < max_items:
+                source, (frame_id, frame, regions, offered_at) = self._items.popitem(last=False)
+                self._busy.add(source)
+                batch.append((source, frame_id, frame, regions))
+                self._record_wait((now - offered_at) * 1000)
+
+        if self.batches == 0:
+            self.avg_batch = len(batch)
+        else:
+            self.avg_batch = 0.9 * self.avg_batch + 0.1 * len(batch)
+        self.batches += 1
+        return batch
+
+    def _record_wait(self, wait_ms):
+        # Queue wait = thời gian frame nằm chờ trước khi worker nhận
+        self.last_wait_ms = wait_ms
+        if self.taken == 0:
+            self.avg_wait_ms = wait_ms
+        else:
+            self.avg_wait_ms = 0.9 * self.avg_wait_ms + 0.1 * wait_ms
+        self.taken += 1
+
+    def done(self):
+        self._busy.clear()
+
+    def stats(self):
+        return {
+            "offered": self.offered,
+            "replaced": self.replaced,
+            "taken": self.taken,
+            "batches": self.batches,
+            "avg_batch": round(self.avg_batch, 2),
+            "queue_wait_ms": round(self.last_wait_ms, 2),
+            "avg_queue_wait_ms": round(self.avg_wait_ms, 2),
+        }
+
+
+# ==================== DETECTION RESULTS ====================
+
+class Detections:
+    """Detections of one frame: N x 4 float32 boxes (x, y, w, h), scores, class ids and track ids.
+
+    Boxes are in the coordinates of the frame that was detected
+    (frame_size = (width, height)). Arrays are read-only and never
+    modified after construction, so stream threads can read the current
+    snapshot without a lock; publishing a new result is a single
+    reference swap.
+    """
+
+    __slots__ = ("boxes", "scores", "class_ids", "track_ids", "frame_id", "frame_size", "timestamp")
+
+    def __init__(self, boxes=(), scores=(), class_ids=None, frame_id=None, frame_size=None,
+                 timestamp=None, track_ids=None):
+        self.boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.array(scores, dtype=np.float32).reshape(-1)
+        if class_ids is None:
+            self.class_ids = np.zeros(len(self.boxes), dtype=np.int16)
+        else:
+            self.class_ids = np.array(class_ids, dtype=np.int16).reshape(-1)
+        # -1 = chưa được tracker gán ID
+        if track_ids is None:
+            self.track_ids = np.full(len(self.boxes), -1, dtype=np.int32)
+        else:
+            self.track_ids = np.array(track_ids, dtype=np.int32).reshape(-1)
+        for array in (self.boxes, self.scores, self.class_ids, self.track_ids):
+            array.flags.writeable = False
+
+        self.frame_id = frame_id
+        self.frame_size = tuple(frame_size) if frame_size is not None else None
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __reduce__(self):
+        # Gửi qua process pool: dựng lại bằng __init__ để mảng vẫn read-only
+        return (Detections, (self.boxes, self.scores, self.class_ids, self.frame_id,
+                             self.frame_size, self.timestamp, self.track_ids))
+
+    def with_frame_id(self, frame_id):
+        """Same detections tagged with the id of the frame they came from (arrays are shared)"""
+        tagged = Detections.__new__(Detections)
+        tagged.boxes, tagged.scores, tagged.class_ids = self.boxes, self.scores, self.class_ids
+        tagged.track_ids = self.track_ids
+        tagged.frame_id = frame_id
+        tagged.frame_size = self.frame_size
+        tagged.timestamp = self.timestamp
+        return tagged
+
+    def transform(self, x0=0, y0=0, scale_x=1.0, scale_y=1.0):
+        """Boxes as int32 (x, y, w, h) after shifting by (x0, y0) and scaling - one vectorized step"""
+        return ((self.boxes - (x0, y0, 0, 0)) * (scale_x, scale_y, scale_x, scale_y)).astype(np.int32)
+
+    def scaled_to(self, width, height):
+        """Boxes as int32 (x, y, w, h) on a width x height display of the same frame"""
+        if self.frame_size is None:
+            return self.transform()
+        frame_w, frame_h = self.frame_size
+        return self.transform(0, 0, width / frame_w, height / frame_h)
+
+    def to_list(self):
+        """[[x, y, w, h, score, track_id], ...] for JSON"""
+        rows = np.column_stack([self.boxes, self.scores]).astype(np.float64).round(2).tolist()
+        for row, track_id in zip(rows, self.track_ids.tolist()):
+            row.append(track_id)
+        return rows
+
+    def to_dict(self):
+        """JSON payload for the dashboard: boxes in frame_size coordinates"""
+        return {
+            "frame_id": self.frame_id,
+            "frame_size": list(self.frame_size) if self.frame_size is not None else None,
+            "timestamp": self.timestamp,
+            "boxes": self.to_list(),
+        }
+
+
+def extract_yolo_boxes(results, frame_size=None):
+    """YOLO results -> Detections.
+
+    Each result's tensors are moved to NumPy once, instead of one
+    .cpu().numpy() call per box.
+    """
+    boxes, scores, class_ids = [], [], []
+    for result in results:
+        if frame_size is None and getattr(result, "orig_shape", None) is not None:
+            frame_size = (result.orig_shape[1], result.orig_shape[0])
+        if len(result.boxes) == 0:
+            continue
+        xyxy = result.boxes.xyxy.cpu().numpy()
+        boxes.append(np.column_stack([xyxy[:, :2], xyxy[:, 2:] - xyxy[:, :2]]))
+        scores.append(result.boxes.conf.cpu().numpy())
+        class_ids.append(result.boxes.cls.cpu().numpy())
+
+    if not boxes:
+        return Detections(frame_size=frame_size)
+    return Detections(np.concatenate(boxes), np.concatenate(scores), np.concatenate(class_ids),
+                      frame_size=frame_size)
+
+
+# ==================== REGIONS OF INTEREST ====================
+
+def roi_regions(boxes, frame_size, pad=16, min_size=(96, 96), max_coverage=0.6):
+    """Turn motion / tracked boxes into non-overlapping crops to detect in.
+
+    Boxes are padded, grown to at least min_size, clipped to the frame and
+    merged while they overlap. Returns None (= detect the whole frame) if
+    there is nothing to crop or the crops would cover most of the frame.
+    """
+    frame_w, frame_h = frame_size
+    regions = []
+    for x, y, w, h in boxes:
+        cx, cy = x + w / 2, y + h / 2
+        w = min(frame_w, max(w + 2 * pad, min_size[0]))
+        h = min(frame_h, max(h + 2 * pad, min_size[1]))
+        x1 = int(min(max(cx - w / 2, 0), frame_w - w))
+        y1 = int(min(max(cy - h / 2, 0), frame_h - h))
+        regions.append([x1, y1, x1 + int(w), y1 + int(h)])
+
+    # Gộp các vùng chồng nhau cho tới khi không còn cặp nào chồng
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+    if not regions or area > max_coverage * frame_w * frame_h:
+        return None
+    return [(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in regions]
+
+
+def tile_regions(frame_size, tile_size=640, overlap=0.2):
+    """Overlapping tiles (x, y, w, h) covering the whole frame.
+
+    tile_size is an int or (width, height). Tiles are spread evenly so
+    the last one ends on the frame edge; a frame no larger than a tile
+    gives a single tile.
+    """
+    frame_w, frame_h = frame_size
+    tile_w, tile_h = (tile_size, tile_size) if isinstance(tile_size, int) else tile_size
+    tile_w, tile_h = min(tile_w, frame_w), min(tile_h, frame_h)
+
+    def starts(length, tile):
+        if length <= tile:
+            return [0]
+        step = max(1, int(tile * (1 - overlap)))
+        count = -(-(length - tile) // step) + 1
+        return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+    return [(x, y, tile_w, tile_h) for y in starts(frame_h, tile_h) for x in starts(frame_w, tile_w)]
+
+
+def nms_detections(detections, iou_threshold=0.5, contain_threshold=0.8, min_hits=1, groups=None,
+                   cut=None):
+    """Greedy non-maximum suppression, highest score first.
+
+    Besides the usual IoU test, a box that lies mostly inside a stronger
+    one (intersection / own area > contain_threshold) is dropped too: that
+    is the half person cut off at a tile edge. min_hits > 1 also drops a
+    box unless that many boxes (itself included) overlapped it by IoU,
+    like the groupThreshold of detectMultiScale.
+
+    groups (crop index per box) limits suppression to boxes from different
+    crops, so two people overlapping inside one crop are both kept; cut
+    (bool per box) limits the containment test to boxes touching a crop
+    edge inside the frame.
+    """
+    if len(detections) < 2 and min_hits <= 1:
+        return detections
+    boxes, scores = detections.boxes, detections.scores
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = np.maximum(boxes[:, 2] * boxes[:, 3], 1e-6)
+
+    # Box bị cắt ở mép crop xếp sau: khi trùng nhau, giữ box thấy trọn người
+    order = np.argsort(-scores) if cut is None else np.lexsort((-scores, cut))
+    keep = []
+    while len(order):
+        best, rest = order[0], order[1:]
+        inter = (np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+                 * np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None))
+        iou = inter / (areas[best] + areas[rest] - inter)
+        contained = inter / areas[rest]
+        if 1 + np.count_nonzero(iou > iou_threshold) >= min_hits:
+            keep.append(best)
+        contained_hit = contained > contain_threshold
+        if cut is not None:
+            contained_hit &= cut[rest]
+        suppressed = (iou > iou_threshold) | contained_hit
+        if groups is not None:
+            suppressed &= groups[rest] != groups[best]
+        order = rest[~suppressed]
+
+    keep = np.sort(np.asarray(keep, dtype=np.intp))
+    return Detections(boxes[keep], scores[keep], detections.class_ids[keep], detections.frame_id,
+                      detections.frame_size, detections.timestamp, detections.track_ids[keep])
+
+
+def _regions_overlap(regions):
+    for i, (ax, ay, aw, ah) in enumerate(regions):
+        for bx, by, bw, bh in regions[i + 1:]:
+            if ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah:
+                return True
+    return False
+
+
+def _cut_at_crop_edge(boxes, crop, frame_size, margin=2):
+    """True for boxes touching an edge of crop that is not also the frame edge"""
+    x, y, w, h = crop
+    frame_w, frame_h = frame_size
+    cut = np.zeros(len(boxes), dtype=bool)
+    if x > 0:
+        cut |= boxes[:, 0] <= x + margin
+    if y > 0:
+        cut |= boxes[:, 1] <= y + margin
+    if x + w < frame_w:
+        cut |= boxes[:, 0] + boxes[:, 2] >= x + w - margin
+    if y + h < frame_h:
+        cut |= boxes[:, 1] + boxes[:, 3] >= y + h - margin
+    return cut
+
+
+def detect_in_regions(detect_batch, frames, regions_list, iou_threshold=0.5):
+    """Detect in every (frame, regions) pair with a single detect_batch(crops) call.
+
+    regions None = whole frame. Boxes found in a crop are shifted back to
+    frame coordinates, so each returned Detections covers its full frame.
+    Only when crops overlap (tiles, tiles + whole frame) are duplicates
+    removed, and only between boxes from different crops; ROI crops never
+    overlap, so their boxes are returned as found.
+    """
+    crops, owners = [], []
+    for index, (frame, regions) in enumerate(zip(frames, regions_list)):
+        for x, y, w, h in regions or [(0, 0, frame.shape[1], frame.shape[0])]:
+            crops.append(frame[y:y + h, x:x + w])
+            owners.append((index, (x, y, w, h)))
+
+    parts = [[] for _ in frames]
+    for crop_index, ((index, crop), found) in enumerate(zip(owners, detect_batch(crops))):
+        if len(found):
+            parts[index].append((crop_index, crop, found.boxes + (crop[0], crop[1], 0, 0), found.scores,
+                                 found.class_ids))
+
+    results = []
+    for frame, regions, part in zip(frames, regions_list, parts):
+        frame_size = (frame.shape[1], frame.shape[0])
+        if not part:
+            results.append(Detections(frame_size=frame_size))
+            continue
+        crop_ids, crop_rects, boxes, scores, class_ids = zip(*part)
+        found = Detections(np.concatenate(boxes), np.concatenate(scores), np.concatenate(class_ids),
+                           frame_size=frame_size)
+        if len(part) > 1 and _regions_overlap(regions):
+            groups = np.concatenate([np.full(len(b), i) for i, b in zip(crop_ids, boxes)])
+            cut = np.concatenate([_cut_at_crop_edge(b, rect, frame_size) for rect, b in zip(crop_rects, boxes)])
+            found = nms_detections(found, iou_threshold, groups=groups, cut=cut)
+        results.append(found)
+    return results
+
+
+# ==================== HOG ENGINE ====================
+
+# Preset HOG, từ nhanh đến nhạy - so sánh tốc độ / recall bằng benchmark.py
+HOG_PRESETS = {
+    "fast": dict(win_stride=(16, 16), scale=1.15, hit_threshold=0.5, min_hits=3),
+    "balanced": dict(win_stride=(8, 8), scale=1.1, hit_threshold=0.3, min_hits=2),
+    "sensitive": dict(win_stride=(8, 8), scale=1.05, hit_threshold=0.0, min_hits=1),
+}
+HOG_WINDOW = (64, 128)   # Cửa sổ của people detector mặc định
+
+
+class HogEngine:
+    """HOG people detector over an explicit image pyramid: frame -> Detections.
+
+    Pyramid levels cover only the person heights plausible for the camera
+    mount: person_height = (min, max) fraction of the frame height.
+    detect_regions() builds the pyramid once per frame and scans every
+    region (ROI crop or tile) on the same levels. configure() switches
+    preset or height range at runtime.
+
+    Upsampling is opt-in: with max_upscale > 1 a minimum below the 128 px
+    window enlarges the frame so small distant people can be found, which
+    detectMultiScale never does - at 240x135 that is ~10-20x slower. Each
+    level runs its own hog.detect(), so unlike detectMultiScale the scales
+    are not scanned in parallel on a multi-core CPU.
+    """
+
+    def __init__(self, preset="balanced", person_height=(0.25, 1.0), padding=(8, 8), max_upscale=1.0):
+        self.padding = padding
+        self.max_upscale = max_upscale
+        self.hog = cv2.HOGDescriptor()
+        self.hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        self.configure(preset, person_height)
+
+        self.frames = 0
+        self.levels = 0
+        self.detect_ms = 0.0
+
+    def configure(self, preset=None, person_height=None):
+        """Change preset (a HOG_PRESETS name) and/or person height range.
+
+        Both are validated before anything changes, so a ValueError leaves
+        the engine as it was.
+        """
+        if preset is not None and preset not in HOG_PRESETS:
+            raise ValueError(f"Unknown HOG preset: {preset}")
+        if person_height is not None:
+            try:
+                low, high = map(float, person_height)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid person height range: {person_height}") from None
+            if not 0 < low <= high:
+                raise ValueError(f"Invalid person height range: {person_height}")
+
+        if preset is not None:
+            self.preset = preset
+            self.params = HOG_PRESETS[preset]
+        if person_height is not None:
+            self.person_height = (low, high)
+
+    def level_factors(self, frame_h):
+        """Resize factor of each pyramid level, smallest image first"""
+        win_h = HOG_WINDOW[1]
+        low = win_h / (self.person_height[1] * frame_h)    # người cao nhất -> thu nhỏ nhiều nhất
+        high = max(low, min(win_h / (self.person_height[0] * frame_h), self.max_upscale))
+        factors = []
+        factor = low
+        while factor <= high * 1.001:
+            factors.append(factor)
+            factor *= self.params["scale"]
+        return factors
+
+    def pyramid(self, frame):
+        """[(factor, level image)] for the levels that still fit a window"""
+        frame_h, frame_w = frame.shape[:2]
+        levels = []
+        for factor in self.level_factors(frame_h):
+            size = (round(frame_w * factor), round(frame_h * factor))
+            if size[0] < HOG_WINDOW[0] or size[1] < HOG_WINDOW[1]:
+                continue
+            levels.append((factor, cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)))
+        return levels
+
+    def detect_regions(self, frame, regions=None):
+        """Detect in regions [(x, y, w, h)] of frame (None = whole frame) in frame coordinates"""
+        started = time.monotonic()
+        frame_h, frame_w = frame.shape[:2]
+        win_w, win_h = HOG_WINDOW
+        params = self.params
+
+        boxes, weights = [], []
+        levels = self.pyramid(frame)
+        for factor, level in levels:
+            level_h, level_w = level.shape[:2]
+            for x, y, w, h in regions or [(0, 0, frame_w, frame_h)]:
+                x0, y0 = int(x * factor), int(y * factor)
+                x1 = min(level_w, int(np.ceil((x + w) * factor)))
+                y1 = min(level_h, int(np.ceil((y + h) * factor)))
+                if x1 - x0 < win_w or y1 - y0 < win_h:
+                    continue
+                found, found_weights = self.hog.detect(level[y0:y1, x0:x1],
+                                                       hitThreshold=params["hit_threshold"],
+                                                       winStride=params["win_stride"], padding=self.padding)
+                if len(found) == 0:
+                    continue
+                level_boxes = np.empty((len(found), 4), dtype=np.float32)
+                level_boxes[:, :2] = (np.asarray(found, dtype=np.float32).reshape(-1, 2) + (x0, y0)) / factor
+                level_boxes[:, 2] = win_w / factor
+                level_boxes[:, 3] = win_h / factor
+                boxes.append(level_boxes)
+                weights.append(np.ravel(found_weights))
+
+        found = Detections(np.concatenate(boxes) if boxes else (),
+                           np.concatenate(weights) if weights else (),
+                           frame_size=(frame_w, frame_h))
+        # Gộp các cửa sổ trùng nhau trên cùng người, giữ cửa sổ có weight cao nhất
+        result = nms_detections(found, min_hits=params["min_hits"])
+
+        self.frames += 1
+        self.levels = len(levels)
+        self.detect_ms = 0.9 * self.detect_ms + 0.1 * (time.monotonic() - started) * 1000
+        return result
+
+    def __call__(self, frame):
+        return self.detect_regions(frame)
+
+    def batch(self, frames):
+        return [self.detect_regions(frame) for frame in frames]
+
+    def stats(self):
+        return {
+            "preset": self.preset,
+            "person_height": list(self.person_height),
+            "levels": self.levels,
+            "frames": self.frames,
+            "detect_ms": round(self.detect_ms, 1),
+        }
+
+
+# ==================== DETECTOR FACTORIES ====================
+# Hàm factory ở cấp module để process con có thể import (pickle) được
+
+def yolo_detector(model_path="yolov8n.pt", conf=0.25):
+    """YOLO person detector: frame -> Detections; detect.batch(frames) runs one batch"""
+    from ultralytics import YOLO
+
+    model = YOLO(model_path)
+
+    def detect(frame):
+        # class 0 = person
+        results = model(frame, conf=conf, classes=[0], verbose=False)
+        return extract_yolo_boxes(results, (frame.shape[1], frame.shape[0]))
+    detect.batch = lambda frames: detect_yolo_batch(model, frames, conf=conf)
+    return detect
+
+
+def detect_yolo_batch(model, frames, conf=0.25):
+    """Run YOLO once over a list of frames; returns one Detections per frame, in order"""
+    results = model(list(frames), conf=conf, classes=[0], verbose=False)
+    return [extract_yolo_boxes([result], (frame.shape[1], frame.shape[0]))
+            for frame, result in zip(frames, results)]
+
+
+class OnnxDetector:
+    """YOLOv8 person detector on an exported ONNX model: frame -> Detections.
+
+    Runs through cv2.dnn (part of opencv-python) or onnxruntime, so neither
+    PyTorch nor ultralytics is needed at runtime. Letterbox preprocessing
+    and NMS are done here; export with `yolo export model=yolov8n.pt
+    format=onnx`. batch(frames) sends all frames in one forward pass when
+    the model has a dynamic batch axis (onnxruntime), one by one otherwise.
+    """
+
+    def __init__(self, model_path="yolov8n.onnx", conf=0.25, iou=0.45, input_size=640, runtime="dnn",
+                 class_id=0):
+        self.model_path = model_path
+        self.conf = conf
+        self.iou = iou
+        self.input_size = input_size
+        self.runtime = runtime
+        self.class_id = class_id
+
+        if runtime == "onnxruntime":
+            import onnxruntime
+
+            self._session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+            model_input = self._session.get_inputs()[0]
+            self._input_name = model_input.name
+            self.dynamic_batch = not isinstance(model_input.shape[0], int)
+        elif runtime == "dnn":
+            self._net = cv2.dnn.readNetFromONNX(model_path)
+            self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            self.dynamic_batch = False
+        else:
+            raise ValueError(f"Unknown ONNX runtime: {runtime}")
+
+    def _letterbox(self, frame):
+        """Resize keeping aspect ratio, pad to input_size x input_size; returns (image, ratio, pad_x, pad_y)"""
+        size = self.input_size
+        frame_h, frame_w = frame.shape[:2]
+        ratio = min(size / frame_w, size / frame_h)
+        new_w, new_h = round(frame_w * ratio), round(frame_h * ratio)
+        pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+
+        # Nền xám 114 giống lúc train YOLO
+        image = np.full((size, size, 3), 114, dtype=np.uint8)
+        image[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(frame, (new_w, new_h),
+                                                                     interpolation=cv2.INTER_LINEAR)
+        return image, ratio, pad_x, pad_y
+
+    def preprocess(self, frames):
+        """Frames -> (NCHW RGB float blob, letterbox params per frame)"""
+        prepared = [self._letterbox(frame) for frame in frames]
+        blob = cv2.dnn.blobFromImages([image for image, _, _, _ in prepared], scalefactor=1 / 255.0,
+                                      swapRB=True)
+        return blob, [letterbox for _, *letterbox in prepared]
+
+    def _forward(self, blob):
+        """NCHW blob -> raw output (N, 4 + classes, anchors)"""
+        if self.runtime == "onnxruntime":
+            return self._session.run(None, {self._input_name: blob})[0]
+        self._net.setInput(blob)
+        return self._net.forward()
+
+    def _decode(self, output, frame_size, ratio, pad_x, pad_y):
+        """One image's raw output -> Detections in frame coordinates"""
+        predictions = output.T   # (anchors, 4 + classes)
+        class_scores = predictions[:, 4:]
+        # Như ultralytics: box thuộc class có score cao nhất, chỉ giữ class person
+        keep = ((class_scores.argmax(axis=1) == self.class_id)
+                & (class_scores[:, self.class_id] >= self.conf))
+        predictions = predictions[keep]
+        scores = class_scores[keep, self.class_id]
+
+        frame_w, frame_h = frame_size
+        cx, cy, w, h = predictions[:, :4].T
+        x1 = np.clip((cx - w / 2 - pad_x) / ratio, 0, frame_w)
+        y1 = np.clip((cy - h / 2 - pad_y) / ratio, 0, frame_h)
+        x2 = np.clip((cx + w / 2 - pad_x) / ratio, 0, frame_w)
+        y2 = np.clip((cy + h / 2 - pad_y) / ratio, 0, frame_h)
+        found = Detections(np.stack([x1, y1, x2 - x1, y2 - y1], axis=1), scores,
+                           np.full(len(scores), self.class_id), frame_size=frame_size)
+        return nms_detections(found, self.iou, contain_threshold=1.0)
+
+    def batch(self, frames):
+        blob, letterboxes = self.preprocess(frames)
+        if self.dynamic_batch:
+            outputs = self._forward(blob)
+        else:
+            outputs = np.concatenate([self._forward(blob[i:i + 1]) for i in range(len(blob))])
+        return [self._decode(output, (frame.shape[1], frame.shape[0]), *letterbox)
+                for frame, output, letterbox in zip(frames, outputs, letterboxes)]
+
+    def __call__(self, frame):
+        return self.batch([frame])[0]
+
+
+def int8_model_path(model_path):
+    """Path of the INT8 export next to an FP32 ONNX model: yolov8n.onnx -> yolov8n_int8.onnx"""
+    root, ext = os.path.splitext(model_path)
+    return f"{root}_int8{ext or '.onnx'}"
+
+
+def create_detector(backend="ultralytics", model_path="yolov8n.pt", conf=0.25, int8=False, runtime=None,
+                    **options):
+    """Person detector for a backend name: "ultralytics" | "onnx" | "hog".
+
+    Every detector maps frame -> Detections and has batch(frames); the
+    function is picklable, so it doubles as a ProcessDetector factory.
+    runtime ("dnn" | "onnxruntime", onnx only) picks what runs the model,
+    None = cv2.dnn. int8=True (onnx only) loads the quantized model from
+    `python benchmark.py quantize` instead of model_path, in onnxruntime
+    unless runtime says otherwise.
+    """
+    if (int8 or runtime is not None) and backend != "onnx":
+        raise ValueError("INT8 mode and runtime need the onnx backend")
+    if int8:
+        model_path = int8_model_path(model_path)
+        runtime = runtime or "onnxruntime"
+    if runtime is not None:
+        options["runtime"] = runtime
+    if backend == "ultralytics":
+        return yolo_detector(model_path, conf)
+    if backend == "onnx":
+        return OnnxDetector(model_path, conf, **options)
+    if backend == "hog":
+        return HogEngine(**options)
+    raise ValueError(f"Unknown detector backend: {backend}")
+
+
+# ==================== PROCESS POOL ====================
+
+def _detector_process(factory, factory_kwargs, jobs, results):
+    """Worker process: build the detector once, then detect frames from shared memory"""
+    detect = factory(**factory_kwargs)
+    # Crop / tile của một frame chạy một batch nếu detector hỗ trợ
+    detect_batch = getattr(detect, "batch", None) or (lambda crops: [detect(crop) for crop in crops])
+    # Detector tự xử lý vùng (HogEngine: một pyramid cho mọi vùng của frame)
+    detect_regions = getattr(detect, "detect_regions", None)
+    attached = {}
+    options = {}
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        slot, name, offset, frame_id, shape, dtype, regions, job_options, retired = job
+
+        # Buffer pool đã thay bằng buffer lớn hơn: bỏ mapping cũ để OS giải phóng bộ nhớ
+        for old in retired:
+            if old in attached:
+                attached.pop(old).close()
+
+        frame = None
+        try:
+            # Map mỗi block shared memory một lần (buffer riêng của pool hoặc ring của capture);
+            # block đã bị unlink chỉ làm hỏng job này, slot vẫn được trả về
+            shm = attached.get(name)
+            if shm is None:
+                shm = attached[name] = shared_memory.SharedMemory(name=name)
+            frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+
+            if job_options != options:
+                # ProcessDetector.configure() đổi tham số lúc chạy, áp dụng từ job kế tiếp
+                detect.configure(**job_options)
+                options = job_options
+            if detect_regions is not None:
+                result = detect_regions(frame, regions)
+            elif regions:
+                result = detect_in_regions(detect_batch, [frame], [regions])[0]
+            else:
+                result = detect(frame)
+            results.put((slot, frame_id, result, None))
+        except Exception as e:
+            results.put((slot, frame_id, None, str(e)))
+        del frame
+
+    for shm in attached.values():
+        shm.close()
+
+
+class ProcessDetector:
+    """Run a detector in worker processes so it does not compete with streaming for the GIL.
+
+    Frames are copied into one shared-memory buffer per in-flight job and
+    only the buffer name travels through the job queue; frames that already
+    live in shared memory (a capture FrameRing) are passed by address with
+    no copy at all. Results come back out of order; on_result(frame_id,
+    result) is called from a collector thread and the caller decides which
+    frame id wins. on_release(frame_id) fires once the worker is done with
+    the frame, whether detection succeeded or not. A worker that dies is
+    restarted and the jobs in flight are counted as errors, so submit()
+    never waits for ever on a slot nobody will return.
+    """
+
+    def __init__(self, factory, factory_kwargs=None, workers=2, on_result=None, on_release=None):
+        self.workers = workers
+        self.on_result = on_result
+        self.on_release = on_release
+        self.completed = 0
+        self.errors = 0
+        self.restarts = 0
+        self._factory = factory
+        self._factory_kwargs = factory_kwargs or {}
+        self._pending = {}   # slot -> frame_id của job đang chạy
+        self._options = {}
+        self._retired = ()   # Tên các block đã unlink (buffer đã thay, ring cũ), gửi kèm job để worker đóng mapping
+        self._closed = False
+
+        ctx = mp.get_context("spawn")
+        self._jobs = ctx.Queue()
+        self._results = ctx.Queue()
+
+        # Mỗi slot = một buffer shared memory, số slot = số job chạy song song
+        self._buffers = [None] * workers
+        self._free = queue.Queue()
+        for slot in range(workers):
+            self._free.put(slot)
+
+        self._ctx = ctx
+        self._processes = [self._start_worker(i) for i in range(workers)]
+
+        self._collector = threading.Thread(target=self._collect, name="detector-results", daemon=True)
+        self._collector.start()
+        # Buffer shared memory tồn tại ngoài process nếu không unlink, như FrameRing
+        atexit.register(self.close)
+
+    def _start_worker(self, i):
+        process = self._ctx.Process(
+            target=_detector_process,
+            args=(self._factory, self._factory_kwargs, self._jobs, self._results),
+            name=f"detector-{i}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    @property
+    def in_flight(self):
+        return self.workers - self._free.qsize()
+
+    def _buffer_for(self, slot, nbytes):
+        shm = self._buffers[slot]
+        if shm is None or shm.size < nbytes:
+            if shm is not None:
+                self.retire(shm.name)
+                shm.close()
+                shm.unlink()
+            shm = self._buffers[slot] = shared_memory.SharedMemory(create=True, size=nbytes)
+        return shm
+
+    def submit(self, frame_id, frame, timeout=None, address=None, regions=None):
+        """Queue a frame for detection; blocks while every worker is busy.
+
+        address = (shared memory name, offset) of frame if it already lives
+        in shared memory that stays valid until on_release(frame_id).
+        regions = crops to detect in (see detect_in_regions), None = whole frame.
+        Returns False if no worker became free within timeout.
+        """
+        try:
+            slot = self._free.get(timeout=timeout)
+        except queue.Empty:
+            return False
+
+        if address is None:
+            shm = self._buffer_for(slot, frame.nbytes)
+            np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf)[:] = frame
+            address = (shm.name, 0)
+        name, offset = address
+        self._pending[slot] = frame_id
+        self._jobs.put((slot, name, offset, frame_id, frame.shape, frame.dtype.str, regions, self._options,
+                        self._retired))
+        return True
+
+    def retire(self, name):
+        """Have the workers close their mapping of an unlinked shared-memory block, from the next job on"""
+        self._retired = (self._retired + (name,))[-RETIRED_BUFFER_NAMES:]
+
+    def configure(self, **options):
+        """Call detector.configure(**options) in every worker, from the next job on"""
+        self._options = {**self._options, **options}
+
+    def _release(self, slot, frame_id):
+        del self._pending[slot]
+        self._free.put(slot)
+        if self.on_release is not None:
+            self.on_release(frame_id)
+
+    def _check_workers(self):
+        """Restart dead workers and fail the jobs in flight - the one a dead worker held never returns"""
+        dead = [i for i, process in enumerate(self._processes) if not process.is_alive()]
+        if not dead or self._closed:
+            return
+        for i in dead:
+            print(f"Detection worker {self._processes[i].name} died (exit code {self._processes[i].exitcode}), restarting")
+            self._processes[i] = self._start_worker(i)
+            self.restarts += 1
+        # Không biết worker chết giữ job nào: trả mọi slot đang chạy, kết quả đến muộn bị bỏ qua
+        for slot, frame_id in list(self._pending.items()):
+            self.errors += 1
+            self._release(slot, frame_id)
+
+    def _collect(self):
+        while not self._closed:
+            try:
+                slot, frame_id, result, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            except (EOFError, OSError):
+                break
+            if slot not in self._pending or self._pending[slot] != frame_id:
+                continue   # Job đã bị coi là mất khi một worker chết
+            self._release(slot, frame_id)
+
+            if error is not None:
+                self.errors += 1
+                print(f"Detection worker error: {error}")
+                continue
+
+            self.completed += 1
+            if self.on_result is not None:
+                try:
+                    self.on_result(frame_id, result)
+                except Exception as e:
+                    print(f"Detection result error: {e}")
+
+    def close(self):
+        """Stop the workers and unlink the shared-memory buffers (also runs at exit)"""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes:
+            process.join(timeout=2)
+        for slot, shm in enumerate(self._buffers):
+            if shm is not None:
+                shm.close()
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+                self._buffers[slot] = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "errors": self.errors,
+            "restarts": self.restarts,
+        }
@@ -0,0 +1,161 @@
+"""
+SAR-BOT PRO - System Log
+Log hệ thống dạng ring buffer cố định, mỗi entry có số thứ tự tăng dần để client chỉ lấy entry mới
+"""
+
+import itertools
+import threading
+import time
+from datetime import datetime
+
+
+class LogRing:
+    """Fixed-capacity, append-only log with monotonically increasing sequence numbers.
+
+    Written from the capture, detection and request threads without a lock:
+    next() on itertools.count and a single list item assignment are atomic
+    under the GIL, so each writer owns its own sequence number and slot.
+    Readers check the seq stored in each slot: an older seq means the
+    writer has not filled it yet (stop there, it will be picked up next
+    time), a newer one means the entry was already overwritten (skip it).
+    Only raising last_seq takes a tiny lock, so it never moves backwards
+    (clients treat a smaller last_seq as a server restart), and readers
+    never return an entry past it - the newest seq a reader got is a
+    cursor that last_seq has already reached.
+    """
+
+    def __init__(self, capacity=200):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._counter = itertools.count(1)
+        self.last_seq = 0   # Gợi ý cho reader, có thể chậm hơn entry mới nhất một chút
+        self._seq_lock = threading.Lock()
+
+    def append(self, message, **fields):
+        """Add an entry; returns it ({"seq", "time", "message"} plus fields)"""
+        seq = next(self._counter)
+        entry = {"seq": seq, "time": datetime.now().strftime("%H:%M:%S"), "message": message}
+        entry.update(fields)
+        self._slots[seq % self.capacity] = entry
+        with self._seq_lock:
+            if seq > self.last_seq:
+                self.last_seq = seq
+        return entry
+
+    def since(self, seq=0):
+        """Entries with a sequence number greater than seq, oldest first"""
+        last_seq = self.last_seq
+        expected = max(seq, last_seq - self.capacity) + 1
+        entries = []
+        while expected <= last_seq:
+            entry = self._slots[expected % self.capacity]
+            if entry is None or entry["seq"] < expected:
+                break   # Chưa được ghi xong
+            if entry["seq"] == expected:
+                entries.append(entry)
+            expected += 1
+        return entries
+
+    def latest(self, count=20):
+        """The newest count entries, newest first"""
+        return self.since(max(0, self.last_seq - count))[::-1][:count]
+
+    def __len__(self):
+        return min(self.last_seq, self.capacity)
+
+
+class LogThrottle:
+    """Per-key rate limit in front of a LogRing that coalesces the repeats.
+
+    The first message for a key is written at once; repeats within
+    interval seconds are only counted. Once the interval has passed, the
+    next message or flush() writes a single entry with the latest text,
+    count (repeats it stands for) and first (time of the first one), so a
+    detection firing every second in a crowd becomes one entry per
+    interval without losing how often it fired. The key defaults to the
+    message itself; pass one explicitly for messages that embed changing
+    values ("PHÁT HIỆN 3 NGƯỜI", "PHÁT HIỆN 4 NGƯỜI").
+    """
+
+    def __init__(self, ring, interval=5.0):
+        self.ring = ring
+        self.interval = interval
+        self._keys = {}   # key -> [last write, pending count, first pending time, latest message]
+        self._lock = threading.Lock()
+
+        self.written = 0
+        self.suppressed = 0
+
+    def log(self, message, key=None):
+        """Write or count one message; returns the written entry or None"""
+        key = message if key is None else key
+        now = time.monotonic()
+        with self._lock:
+            state = self._keys.get(key)
+            if state is not None and now - state[0] < self.interval:
+                if state[1] == 0:
+                    state[2] = datetime.now().strftime("%H:%M:%S")
+                state[1] += 1
+                state[3] = message
+                self.suppressed += 1
+                return None
+
+            if state is not None and state[1]:
+                fields = {"count": state[1] + 1, "first": state[2]}
+            else:
+                fields = {}
+            self._keys[key] = [now, 0, None, message]
+            self.written += 1
+        return self.ring.append(message, **fields)
+
+    def flush(self):
+        """Write the pending repeats of every key whose interval has passed - call periodically"""
+        now = time.monotonic()
+        pending = []
+        with self._lock:
+            for key, state in list(self._keys.items()):
+                if now - state[0] < self.interval:
+                    continue
+                if state[1]:
+                    pending.append((state[3], state[1], state[2]))
+                    self._keys[key] = [now, 0, None, state[3]]
+                    self.written += 1
+                else:
+                    del self._keys[key]   # Key không còn lặp lại
+        for message, count, first in pending:
+            self.ring.append(message, count=count, first=first)
+
+    def stats(self):
+        return {
+            "written": self.written,
+            "suppressed": self.suppressed,
+            "keys": len(self._keys),
+        }
+
+
+class DebugChannel:
+    """Sampled debug output for per-frame code paths.
+
+    debug("draw", "Drawing %d boxes", n) prints at most one line per key
+    every interval seconds, with how many were skipped since the last one;
+    the message is only formatted when it is printed. Disabled, a call
+    costs one attribute check.
+    """
+
+    def __init__(self, enabled=False, interval=1.0):
+        self.enabled = enabled
+        self.interval = interval
+        self._last = {}
+        self._skipped = {}
+
+    def __call__(self, key, message, *args):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self._last.get(key, -self.interval) < self.interval:
+            self._skipped[key] = self._skipped.get(key, 0) + 1
+            return
+        self._last[key] = now
+        skipped = self._skipped.pop(key, 0)
+        text = message % args if args else message
+        print(f"[DEBUG] {text}" + (f" (+{skipped} skipped)" if skipped else ""))
@@ -0,0 +1,92 @@
+"""
+SAR-BOT PRO - Motion Gate
+So sánh frame rất nhỏ với nền để chỉ chạy detection khi khung hình có chuyển động
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Decide when detection is worth running from cheap background subtraction.
+
+    Every frame is shrunk to a tiny blurred grayscale image and compared
+    with a running-average background. If enough pixels changed, detection
+    may run every min_interval seconds (faster than the fixed interval);
+    on a static scene it only runs every max_interval seconds as a
+    fallback, so a person standing still is still confirmed.
+    """
+
+    def __init__(self, min_interval=0.5, max_interval=10.0, size=(160, 90), threshold=25,
+                 min_ratio=0.005, alpha=0.05, hold=1.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.size = size
+        self.threshold = threshold
+        self.min_ratio = min_ratio
+        self.alpha = alpha
+        self.hold = hold
+
+        self._background = None
+        self.mask = None
+        self.ratio = 0.0
+        self.last_motion = 0.0
+
+        self.motion_frames = 0
+        self.static_frames = 0
+
+    @property
+    def motion(self):
+        """True while motion was seen within the last `hold` seconds"""
+        return time.monotonic() - self.last_motion < self.hold
+
+    def update(self, frame):
+        """Compare frame with the background; returns the fraction of changed pixels"""
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_LINEAR)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+        if self._background is None:
+            self._background = gray.astype(np.float32)
+            self.mask = np.zeros_like(gray)
+            return 0.0
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        _, self.mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        self.ratio = cv2.countNonZero(self.mask) / self.mask.size
+
+        # Nền thích nghi dần với thay đổi ánh sáng
+        cv2.accumulateWeighted(gray, self._background, self.alpha)
+
+        if self.ratio >= self.min_ratio:
+            self.last_motion = time.monotonic()
+            self.motion_frames += 1
+        else:
+            self.static_frames += 1
+        return self.ratio
+
+    def regions(self, frame_size):
+        """Bounding boxes (x, y, w, h) of the moving areas, scaled to a frame of frame_size"""
+        if self.mask is None or not self.motion:
+            return []
+        mask = cv2.dilate(self.mask, None, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        scale_x = frame_size[0] / self.size[0]
+        scale_y = frame_size[1] / self.size[1]
+        return [(x * scale_x, y * scale_y, w * scale_x, h * scale_y)
+                for x, y, w, h in map(cv2.boundingRect, contours)]
+
+    def due(self, since_last_detection):
+        """True if detection should run now, given seconds since the last one"""
+        interval = self.min_interval if self.motion else self.max_interval
+        return since_last_detection >= interval
+
+    def stats(self):
+        return {
+            "motion": self.motion,
+            "motion_ratio": round(self.ratio, 4),
+            "motion_frames": self.motion_frames,
+            "static_frames": self.static_frames,
+        }
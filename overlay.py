@@ -0,0 +1,104 @@
+"""
+SAR-BOT PRO - Overlay Compositor
+Vẽ HUD một lần cho mỗi độ phân giải + nội dung, mỗi frame chỉ copy đúng các pixel của HUD
+"""
+
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+class OverlayLayer:
+    """A pre-rendered HUD: BGR pixels plus alpha, cut into the regions it covers.
+
+    Built from the same drawing rendered on a black and on a white canvas:
+    where both agree the HUD is opaque, where they differ the background
+    shows through, and the difference gives the alpha of anti-aliased or
+    blended pixels. Opaque pixels are applied with one masked cv2.copyTo
+    per HUD region (counter, indicator, crosshair); the few partly
+    transparent ones are blended.
+    """
+
+    def __init__(self, black, white, margin=4):
+        height, width = black.shape[:2]
+        self.size = (width, height)
+
+        alpha = 255 - (white.astype(np.int16) - black).max(axis=2)
+        alpha = np.clip(alpha, 0, 255).astype(np.uint8)
+        opaque = np.where(alpha == 255, 255, 0).astype(np.uint8)
+
+        # Mỗi cụm pixel HUD thành một vùng chữ nhật, chỉ copy trong các vùng này
+        kernel = np.ones((2 * margin + 1, 2 * margin + 1), dtype=np.uint8)
+        _, _, components, _ = cv2.connectedComponentsWithStats(cv2.dilate(opaque, kernel))
+        self.regions = []
+        for x, y, w, h, _ in components[1:]:
+            area = (slice(y, y + h), slice(x, x + w))
+            self.regions.append((area, black[area].copy(), opaque[area].copy()))
+
+        # Pixel trong suốt một phần (LINE_AA, addWeighted): màu trên nền đen đã nhân alpha
+        self.blend_y, self.blend_x = np.nonzero((alpha > 0) & (alpha < 255))
+        self.blend_alpha = alpha[self.blend_y, self.blend_x, None].astype(np.uint16)
+        self.blend_pixels = black[self.blend_y, self.blend_x].astype(np.uint16)
+        self.pixel_count = int(np.count_nonzero(alpha))
+
+    def apply(self, frame):
+        """Composite onto a BGR frame of the layer size, in place; returns the frame"""
+        for area, pixels, mask in self.regions:
+            cv2.copyTo(pixels, mask, frame[area])
+        if len(self.blend_y):
+            under = frame[self.blend_y, self.blend_x].astype(np.uint16)
+            blended = (under * (255 - self.blend_alpha) + 127) // 255 + self.blend_pixels
+            frame[self.blend_y, self.blend_x] = np.minimum(blended, 255).astype(np.uint8)
+        return frame
+
+
+class OverlayCompositor:
+    """Cache of OverlayLayers keyed by (width, height, state).
+
+    draw(canvas, state) is ordinary cv2 drawing code for the HUD; state is
+    a hashable tuple of everything the HUD shows (person count, detector
+    busy, ...). The HUD is only redrawn when the output size or the state
+    changes; every other frame costs one masked copy of the HUD pixels.
+    """
+
+    def __init__(self, draw, max_entries=16):
+        self.draw = draw
+        self.max_entries = max_entries
+        self._layers = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.renders = 0
+        self.hits = 0
+
+    def layer(self, width, height, state=()):
+        key = (width, height, state)
+        with self._lock:
+            layer = self._layers.get(key)
+            if layer is not None:
+                self._layers.move_to_end(key)
+                self.hits += 1
+                return layer
+
+            black = np.zeros((height, width, 3), dtype=np.uint8)
+            white = np.full((height, width, 3), 255, dtype=np.uint8)
+            self.draw(black, state)
+            self.draw(white, state)
+            layer = self._layers[key] = OverlayLayer(black, white)
+            while len(self._layers) > self.max_entries:
+                self._layers.popitem(last=False)
+            self.renders += 1
+            return layer
+
+    def apply(self, frame, state=()):
+        """Composite the HUD for state onto frame; returns the frame"""
+        height, width = frame.shape[:2]
+        return self.layer(width, height, state).apply(frame)
+
+    def stats(self):
+        return {
+            "layers": len(self._layers),
+            "renders": self.renders,
+            "hits": self.hits,
+        }
@@ -10,6 +10,7 @@ class SARBotDashboard {
 
     init() {
         this.setupPolling();
+        this.setupDetectionBoxes();
         this.animateStartup();
     }
 
@@ -17,17 +18,26 @@ class SARBotDashboard {
     async updateStatus() {
         try {
             const response = await fetch('/api/status');
-            const data = await response.json();
-            
-            // Update sensor values with animation
-            this.animateValue('gas-value', data.sensor_data.gas_level);
-            this.animateValue('dust-value', data.sensor_data.dust_pm25);
-            this.animateValueDecimal('temp-value', data.sensor_data.temperature, 1);
-            this.animateValue('co-value', data.sensor_data.co_level);
-            this.animateValue('signal-value', Math.round(data.sensor_data.signal_strength), '%');
-            this.animateValue('battery-value', Math.round(data.sensor_data.battery_level), '%');
-            
-            // Update detection info
+            this.applyStatus(await response.json());
+        } catch (error) {
+            console.error('Failed to fetch status:', error);
+        }
+    }
+
+    // Full status from /api/status or only the changed values from /api/events
+    applyStatus(data) {
+        const sensors = data.sensor_data || {};
+        
+        // Update sensor values with animation
+        if ('gas_level' in sensors) this.animateValue('gas-value', sensors.gas_level);
+        if ('dust_pm25' in sensors) this.animateValue('dust-value', sensors.dust_pm25);
+        if ('temperature' in sensors) this.animateValueDecimal('temp-value', sensors.temperature, 1);
+        if ('co_level' in sensors) this.animateValue('co-value', sensors.co_level);
+        if ('signal_strength' in sensors) this.animateValue('signal-value', Math.round(sensors.signal_strength), '%');
+        if ('battery_level' in sensors) this.animateValue('battery-value', Math.round(sensors.battery_level), '%');
+        
+        // Update detection info
+        if ('detected_persons' in data) {
             const detectionInfo = document.getElementById('detection-info');
             const personCount = detectionInfo.querySelector('.person-count');
             personCount.textContent = data.detected_persons;
@@ -37,41 +47,61 @@ class SARBotDashboard {
             } else {
                 detectionInfo.classList.remove('active');
             }
-            
-        } catch (error) {
-            console.error('Failed to fetch status:', error);
         }
     }
 
-    // Fetch and update logs
+    // Fetch and update logs - only entries newer than the last seq seen
     async updateLogs() {
         try {
-            const response = await fetch('/api/logs');
+            const since = this.logSeq || 0;
+            const response = await fetch(since ? `/api/logs?since=${since}` : '/api/logs');
             const data = await response.json();
             
-            const logsContent = document.getElementById('logs-content');
-            let html = '';
-            
-            data.logs.forEach(log => {
-                const isHighlight = log.message.includes('AI VISION') || 
-                                   log.message.includes('PHÁT HIỆN');
-                html += `
-                    <div class="log-entry">
-                        <span class="log-time">[${log.time}]</span>
-                        <span class="log-arrow">&gt;</span>
-                        <span class="log-message ${isHighlight ? 'highlight' : ''}">${log.message}</span>
-                    </div>
-                `;
-            });
-            
-            html += '<div class="cursor-blink"></div>';
-            logsContent.innerHTML = html;
-            
+            if (data.last_seq < since) {
+                // Server restarted, sequence numbers start over
+                this.logSeq = 0;
+                return this.updateLogs();
+            }
+            if (data.logs.length) {
+                this.addLogs({reset: !since, entries: data.logs.slice().reverse()});
+            }
+            // Only advance past entries actually received; last_seq may include ones not yet visible
+            this.logSeq = data.cursor;
         } catch (error) {
             console.error('Failed to fetch logs:', error);
         }
     }
 
+    // New entries from /api/events arrive oldest first; the panel shows newest first
+    addLogs(data) {
+        if (data.reset) this.logs = [];
+        data.entries.forEach(entry => this.logs.unshift(entry));
+        this.logs = this.logs.slice(0, 20);
+        this.renderLogs();
+    }
+
+    renderLogs() {
+        const logsContent = document.getElementById('logs-content');
+        let html = '';
+        
+        this.logs.forEach(log => {
+            const isHighlight = log.message.includes('AI VISION') || 
+                               log.message.includes('PHÁT HIỆN');
+            // Coalesced entry: the same event repeated count times since log.first
+            const count = log.count > 1 ? `<span class="log-count">×${log.count} (${log.first} - ${log.time})</span>` : '';
+            html += `
+                <div class="log-entry">
+                    <span class="log-time">[${log.time}]</span>
+                    <span class="log-arrow">&gt;</span>
+                    <span class="log-message ${isHighlight ? 'highlight' : ''}">${log.message}</span>${count}
+                </div>
+            `;
+        });
+        
+        html += '<div class="cursor-blink"></div>';
+        logsContent.innerHTML = html;
+    }
+
     // Animate number value changes
     animateValue(elementId, newValue, suffix = '') {
         const element = document.getElementById(elementId);
@@ -134,6 +164,109 @@ class SARBotDashboard {
         }, stepTime);
     }
 
+    // Client-side boxes: video stream is clean, boxes come from /api/detections/stream
+    setupDetectionBoxes() {
+        const video = document.getElementById('video-stream');
+        const canvas = document.getElementById('detection-canvas');
+        if (!video || !canvas || video.dataset.boxes !== 'client' || !window.EventSource) return;
+
+        this.detections = null;
+        this.boxesDirty = false;
+        const source = new EventSource('/api/detections/stream');
+        source.onmessage = (event) => {
+            this.detections = JSON.parse(event.data);
+            this.requestBoxesDraw(video, canvas);
+        };
+        window.addEventListener('resize', () => this.requestBoxesDraw(video, canvas));
+    }
+
+    // At most one redraw per animation frame, however many events arrive
+    requestBoxesDraw(video, canvas) {
+        if (this.boxesDirty) return;
+        this.boxesDirty = true;
+        requestAnimationFrame(() => {
+            this.boxesDirty = false;
+            this.drawDetections(video, canvas);
+        });
+    }
+
+    drawDetections(video, canvas) {
+        const ratio = window.devicePixelRatio || 1;
+        const width = canvas.clientWidth;
+        const height = canvas.clientHeight;
+        if (canvas.width !== Math.round(width * ratio) || canvas.height !== Math.round(height * ratio)) {
+            canvas.width = Math.round(width * ratio);
+            canvas.height = Math.round(height * ratio);
+        }
+
+        const ctx = canvas.getContext('2d');
+        ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+        ctx.clearRect(0, 0, width, height);
+
+        const data = this.detections;
+        if (!data || !data.frame_size || !data.boxes.length) return;
+
+        // Boxes are in detection-frame coordinates; the stream is that frame resized
+        // (fit 'stretch') or center-cropped to the stream aspect first (fit 'crop',
+        // same as crop_region on the server), then shown with object-fit: cover
+        const [frameWidth, frameHeight] = data.frame_size;
+        const imageWidth = video.naturalWidth || frameWidth;
+        const imageHeight = video.naturalHeight || frameHeight;
+        let [cropX, cropY, cropWidth, cropHeight] = [0, 0, frameWidth, frameHeight];
+        if (data.fit === 'crop') {
+            const ratio = imageWidth / imageHeight;
+            if (frameWidth / frameHeight > ratio) {
+                cropWidth = Math.floor(frameHeight * ratio);
+                cropX = Math.floor((frameWidth - cropWidth) / 2);
+            } else if (frameWidth / frameHeight < ratio) {
+                cropHeight = Math.floor(frameWidth / ratio);
+                cropY = Math.floor((frameHeight - cropHeight) / 2);
+            }
+        }
+        const cover = Math.max(width / imageWidth, height / imageHeight);
+        const scaleX = cover * imageWidth / cropWidth;
+        const scaleY = cover * imageHeight / cropHeight;
+        const offsetX = (width - imageWidth * cover) / 2 - cropX * scaleX;
+        const offsetY = (height - imageHeight * cover) / 2 - cropY * scaleY;
+
+        ctx.font = 'bold 13px monospace';
+        ctx.textBaseline = 'bottom';
+        // box: [x, y, w, h, score, track_id] (Detections.to_list)
+        data.boxes.forEach(([bx, by, bw, bh, score, trackId]) => {
+            const x = offsetX + bx * scaleX;
+            const y = offsetY + by * scaleY;
+            const w = bw * scaleX;
+            const h = bh * scaleY;
+            const corner = Math.min(30 * cover, w / 3, h / 3);
+
+            ctx.lineWidth = 2;
+            ctx.strokeStyle = '#00ff00';
+            ctx.strokeRect(x, y, w, h);
+            ctx.lineWidth = 1;
+            ctx.strokeStyle = '#ffff00';
+            ctx.strokeRect(x + 3, y + 3, w - 6, h - 6);
+
+            ctx.lineWidth = 3;
+            ctx.strokeStyle = '#ff0000';
+            ctx.beginPath();
+            [[x, y, 1, 1], [x + w, y, -1, 1], [x, y + h, 1, -1], [x + w, y + h, -1, -1]].forEach(([cx, cy, dx, dy]) => {
+                ctx.moveTo(cx + dx * corner, cy);
+                ctx.lineTo(cx, cy);
+                ctx.lineTo(cx, cy + dy * corner);
+            });
+            ctx.stroke();
+
+            const id = trackId >= 0 ? `#${trackId} ` : '';
+            const label = `${id}PERSON ${Math.round(score * 100)}%`;
+            const labelWidth = ctx.measureText(label).width + 8;
+            const labelY = y > 20 ? y : y + h + 20;
+            ctx.fillStyle = 'rgba(0, 0, 0, 0.7)';
+            ctx.fillRect(x, labelY - 18, labelWidth, 18);
+            ctx.fillStyle = '#ffff00';
+            ctx.fillText(label, x + 4, labelY - 2);
+        });
+    }
+
     // Startup animation
     animateStartup() {
         const cards = document.querySelectorAll('.sensor-card');
@@ -159,8 +292,31 @@ class SARBotDashboard {
         }
     }
 
-    // Setup polling for real-time updates
+    // Setup real-time updates: pushed over /api/events, polling if EventSource is missing
     setupPolling() {
+        this.logs = [];
+        
+        if (window.EventSource) {
+            // Server only sends what changed; EventSource reconnects by itself
+            const events = new EventSource('/api/events');
+            let connected = false;
+            events.onopen = () => { connected = true; };
+            events.onerror = () => {
+                // Never connected: app without /api/events, poll instead
+                if (!connected) {
+                    events.close();
+                    this.startPolling();
+                }
+            };
+            events.addEventListener('status', (event) => this.applyStatus(JSON.parse(event.data)));
+            events.addEventListener('log', (event) => this.addLogs(JSON.parse(event.data)));
+            return;
+        }
+        
+        this.startPolling();
+    }
+
+    startPolling() {
         // Initial update
         this.updateStatus();
         this.updateLogs();
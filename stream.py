@@ -0,0 +1,864 @@
+"""
+SAR-BOT PRO - Shared Video Pipeline
+Một thread capture duy nhất giữ camera, mọi viewer /video_feed chỉ đọc frame mới nhất
+"""
+
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+# FFmpeg options cho RTSP độ trễ thấp
+FFMPEG_LOW_LATENCY_OPTIONS = (
+    "rtsp_transport;tcp|"
+    "fflags;nobuffer|"
+    "flags;low_delay|"
+    "framedrop;1"
+)
+
+MULTIPART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+# width/height = None nghĩa là giữ nguyên độ phân giải / tỉ lệ của camera
+StreamProfile = namedtuple("StreamProfile", "width height quality fps")
+
+STREAM_PROFILES = {
+    "low": StreamProfile(480, 270, 55, 12),       # Mạng chậm, tablet 3G
+    "medium": StreamProfile(640, 360, 65, 15),    # Cân bằng
+    "full": StreamProfile(None, None, 85, 15),    # Full độ phân giải camera
+}
+
+# Các bậc chất lượng cho adaptive bitrate, từ thấp đến cao
+ABR_LADDER = [
+    StreamProfile(320, 180, 45, 8),
+    StreamProfile(480, 270, 55, 12),
+    StreamProfile(640, 360, 65, 15),
+    StreamProfile(960, 540, 75, 15),
+    StreamProfile(None, None, 85, 15),
+]
+
+# Giới hạn tham số do client gửi lên
+MIN_STREAM_WIDTH, MAX_STREAM_WIDTH = 160, 1920
+MIN_JPEG_QUALITY, MAX_JPEG_QUALITY = 10, 95
+MIN_STREAM_FPS, MAX_STREAM_FPS = 1, 30
+
+
+def _int_arg(args, key):
+    try:
+        return int(args.get(key))
+    except (TypeError, ValueError):
+        return None
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def parse_profile(args, default, profiles=STREAM_PROFILES):
+    """Build a StreamProfile from /video_feed query parameters.
+
+    ?profile=low|medium|full picks a preset; w, q and fps override single
+    fields. Widths are rounded to multiples of 16 so that similar requests
+    share one resize+encode stage instead of each getting their own.
+    """
+    profile = profiles.get(args.get("profile", ""), default)
+
+    width = _int_arg(args, "w")
+    if width is not None:
+        width = _clamp(width, MIN_STREAM_WIDTH, MAX_STREAM_WIDTH) // 16 * 16
+        profile = profile._replace(width=width, height=None)
+
+    quality = _int_arg(args, "q")
+    if quality is not None:
+        profile = profile._replace(quality=_clamp(quality, MIN_JPEG_QUALITY, MAX_JPEG_QUALITY))
+
+    fps = _int_arg(args, "fps")
+    if fps is not None:
+        profile = profile._replace(fps=_clamp(fps, MIN_STREAM_FPS, MAX_STREAM_FPS))
+
+    return profile
+
+
+def cap_profile(profile, ceiling):
+    """Clamp profile to the ceiling profile (None = unlimited)"""
+    if profile.width is not None and (ceiling.width is None or profile.width <= ceiling.width):
+        width, height = profile.width, profile.height
+    else:
+        width, height = ceiling.width, ceiling.height
+    return StreamProfile(width, height, min(profile.quality, ceiling.quality),
+                         min(profile.fps, ceiling.fps))
+
+
+def profile_size(profile, frame_w, frame_h):
+    """Output (width, height) of a profile for a given camera frame size (never upscales)"""
+    if profile.width is None or profile.width >= frame_w:
+        return frame_w, frame_h
+    if profile.height is None:
+        return profile.width, max(2, round(profile.width * frame_h / frame_w / 2) * 2)
+    return profile.width, profile.height
+
+
+def encode_jpeg_chunk(frame, quality):
+    """Encode a frame as one multipart/x-mixed-replace chunk (None on failure)"""
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    ret, buffer = cv2.imencode('.jpg', frame, encode_param)
+    if not ret:
+        return None
+    # join đọc thẳng buffer numpy, không qua bản copy tobytes()
+    return b''.join((MULTIPART_HEADER, buffer, b'\r\n'))
+
+
+class FramePacer:
+    """Deadline-based frame pacing on the monotonic clock.
+
+    Instead of sleeping a fixed 1/fps after the work, the next deadline is
+    scheduled from the previous one and only the remainder is slept, so
+    grab/resize/draw/encode time no longer lowers the frame rate.
+    """
+
+    def __init__(self, fps):
+        self.fps = fps
+        self.achieved_fps = 0.0
+        self.late_frames = 0
+        self._deadline = None
+        self._last_call = None
+
+    def wait(self, fps=None):
+        """Sleep until the next frame deadline - call once per delivered frame"""
+        if fps is not None:
+            self.fps = fps
+        interval = 1.0 / self.fps
+        now = time.monotonic()
+
+        if self._last_call is not None:
+            period = now - self._last_call
+            if period > 0:
+                if self.achieved_fps == 0.0:
+                    self.achieved_fps = 1.0 / period
+                else:
+                    self.achieved_fps = 0.9 * self.achieved_fps + 0.1 / period
+        self._last_call = now
+
+        if self._deadline is None:
+            self._deadline = now
+        self._deadline += interval
+
+        remaining = self._deadline - now
+        if remaining > 0:
+            time.sleep(remaining)
+        elif remaining < -interval:
+            # Trễ hơn một frame: đặt lại mốc thay vì gửi dồn để đuổi kịp
+            self.late_frames += 1
+            self._deadline = now
+
+    def stats(self):
+        return {
+            "target_fps": self.fps,
+            "achieved_fps": round(self.achieved_fps, 1),
+            "late_frames": self.late_frames,
+        }
+
+
+class Mailbox:
+    """Single-slot per-viewer mailbox - a newer frame replaces an unread one.
+
+    A slow viewer therefore always gets the newest frame instead of a
+    backlog; every frame it never saw is counted in ``skipped``.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, client=""):
+        self.id = next(Mailbox._ids)
+        self.client = client
+        self.connected_at = time.time()
+        self.delivered = 0
+        self.skipped = 0
+        self.abr = None
+        self.pacer = None
+        self._cond = threading.Condition()
+        self._item = None
+
+    def put(self, seq, frame):
+        with self._cond:
+            if self._item is not None:
+                self.skipped += 1
+            self._item = (seq, frame)
+            self._cond.notify()
+
+    def take(self, timeout=1.0):
+        """Wait for the newest frame; returns (seq, frame), frame is None on timeout"""
+        with self._cond:
+            if self._item is None:
+                self._cond.wait(timeout)
+            item = self._item
+            self._item = None
+        if item is None:
+            return 0, None
+        self.delivered += 1
+        return item
+
+    def stats(self):
+        stats = {
+            "id": self.id,
+            "client": self.client,
+            "connected_s": round(time.time() - self.connected_at),
+            "delivered": self.delivered,
+            "skipped": self.skipped,
+        }
+        if self.pacer is not None:
+            stats.update(self.pacer.stats())
+        if self.abr is not None:
+            stats["abr"] = self.abr.stats()
+        return stats
+
+
+class FrameRing:
+    """Preallocated frame slots in one shared-memory block.
+
+    The capture thread decodes straight into the next free slot and every
+    stage passes (seq, view) around instead of copying pixels. Slots are
+    reused once the ring wraps; a consumer that holds a frame for long
+    pins it, short readers check holds(seq) afterwards instead. Worker
+    processes map the same block by name, see address().
+    """
+
+    def __init__(self, shape, slots=8, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.dtype = np.dtype(dtype)
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        self._shm = shared_memory.SharedMemory(create=True, size=self.frame_bytes * slots)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+        # seq = 0: slot trống hoặc đang được ghi
+        self._seqs = [0] * slots
+        self._pins = [0] * slots
+        self._next = 0
+        self._lock = threading.Lock()
+        self.overruns = 0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def pinned(self):
+        return sum(1 for pins in self._pins if pins)
+
+    def acquire(self):
+        """Index of the next unpinned slot to write into, or None if every slot is pinned"""
+        with self._lock:
+            for step in range(self.slots):
+                index = (self._next + step) % self.slots
+                if self._pins[index] == 0:
+                    self._seqs[index] = 0
+                    self._next = (index + 1) % self.slots
+                    return index
+            self.overruns += 1
+            return None
+
+    def commit(self, index, seq):
+        self._seqs[index] = seq
+
+    def contains(self, frame):
+        return np.may_share_memory(frame, self.frames)
+
+    def holds(self, seq):
+        """True while the slot written for seq has not been reused"""
+        return seq in self._seqs
+
+    def pin(self, seq):
+        """Keep the slot holding seq from being reused until unpin(seq)"""
+        with self._lock:
+            if seq in self._seqs:
+                self._pins[self._seqs.index(seq)] += 1
+                return True
+            return False
+
+    def unpin(self, seq):
+        with self._lock:
+            if seq in self._seqs:
+                index = self._seqs.index(seq)
+                self._pins[index] = max(0, self._pins[index] - 1)
+
+    def address(self, seq):
+        """(shared memory name, byte offset) of the frame for seq, or None if it was reused"""
+        if seq in self._seqs:
+            return self.name, self._seqs.index(seq) * self.frame_bytes
+        return None
+
+    def unlink(self):
+        """Remove the shared memory name; existing mappings stay valid"""
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        self.frames = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Còn view đang được dùng: mapping tự giải phóng khi view bị thu hồi
+            pass
+        self.unlink()
+
+    def stats(self):
+        return {
+            "slots": self.slots,
+            "pinned": self.pinned,
+            "overruns": self.overruns,
+        }
+
+
+class CaptureThread:
+    """Background thread that owns cv2.VideoCapture and publishes the newest frame"""
+
+    def __init__(self, rtsp_url, use_rtsp=True, target_fps=15, webcam_index=0,
+                 webcam_size=(640, 360), ffmpeg_options=FFMPEG_LOW_LATENCY_OPTIONS,
+                 open_timeout_ms=None, live_tolerance_ms=None, max_drain=30, max_failed_reads=15,
+                 max_reconnect_attempts=5, ring_slots=8, log=print, on_connect=None, on_frame=None,
+                 on_ring_closed=None):
+        self.rtsp_url = rtsp_url
+        self.use_rtsp = use_rtsp
+        self.target_fps = target_fps
+        self.webcam_index = webcam_index
+        self.webcam_size = webcam_size
+        self.ffmpeg_options = ffmpeg_options
+        self.open_timeout_ms = open_timeout_ms
+        self.live_tolerance_ms = live_tolerance_ms
+        self.max_drain = max_drain
+        self.max_failed_reads = max_failed_reads
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.ring_slots = ring_slots
+        self.log = log
+        self.on_connect = on_connect
+        self.on_frame = on_frame
+        self.on_ring_closed = on_ring_closed
+
+        self.camera = None
+        self.reconnect_attempts = 0
+
+        # Trạng thái bám live edge của RTSP buffer
+        self.frame_interval_ms = 1000.0 / target_fps
+        self.lag_ms = 0.0
+        self.drained_frames = 0
+        self._min_offset_ms = None
+        self._last_pos_ms = None
+        self._live_edge_seen = False
+
+        # Ring shared memory, tạo khi biết kích thước frame đầu tiên
+        self.ring = None
+        self._ring_index = None
+        # Ring cũ sau khi đổi độ phân giải, giữ đến khi không còn slot bị pin
+        self._old_rings = ()
+        self._ring_lock = threading.Lock()
+
+        # Slot chứa frame mới nhất, viewer chờ trên condition này
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._frame_time = 0.0
+
+        # Copy-on-write tuple: capture thread đọc không cần lock
+        self._subscribers = ()
+        self._sub_lock = threading.Lock()
+
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def is_connected(self):
+        return self.camera is not None
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def start(self):
+        """Start the capture thread once - safe to call from every viewer"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="capture", daemon=True)
+                self._thread.start()
+                atexit.register(self._unlink_ring)
+        return self
+
+    def subscribe(self, client=""):
+        """Register a viewer mailbox, primed with the newest frame if there is one"""
+        mailbox = Mailbox(client)
+        with self._cond:
+            if self._frame is not None:
+                mailbox.put(self._seq, self._frame)
+        with self._sub_lock:
+            self._subscribers = self._subscribers + (mailbox,)
+        return mailbox
+
+    def unsubscribe(self, mailbox):
+        with self._sub_lock:
+            self._subscribers = tuple(m for m in self._subscribers if m is not mailbox)
+
+    def subscriber_stats(self):
+        return [mailbox.stats() for mailbox in self._subscribers]
+
+    def latest(self):
+        """Return (seq, frame, timestamp) of the newest frame without waiting"""
+        with self._cond:
+            return self._seq, self._frame, self._frame_time
+
+    def _open(self):
+        """Open RTSP stream or local webcam"""
+        try:
+            if self.use_rtsp:
+                self.log("🔌 Đang kết nối EZVIZ camera...")
+                os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = self.ffmpeg_options
+
+                camera = cv2.VideoCapture(self.rtsp_url, cv2.CAP_FFMPEG)
+                camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                camera.set(cv2.CAP_PROP_FPS, self.target_fps)
+                if self.open_timeout_ms:
+                    camera.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, self.open_timeout_ms)
+                    camera.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, self.open_timeout_ms)
+            else:
+                self.log("🔌 Đang kết nối webcam local...")
+                camera = cv2.VideoCapture(self.webcam_index)
+                camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.webcam_size[0])
+                camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.webcam_size[1])
+
+            if camera.isOpened():
+                self.camera = camera
+                self.reconnect_attempts = 0
+
+                stream_fps = camera.get(cv2.CAP_PROP_FPS)
+                if not 0 < stream_fps <= 120:
+                    stream_fps = self.target_fps
+                self.frame_interval_ms = 1000.0 / stream_fps
+                self._min_offset_ms = None
+                self._last_pos_ms = None
+                self._live_edge_seen = False
+                if self.on_connect is not None:
+                    self.on_connect()
+                return True
+
+            camera.release()
+            self.log("❌ LỖI: Không thể kết nối camera")
+        except Exception as e:
+            self.log(f"❌ LỖI: {str(e)}")
+        return False
+
+    def _release(self):
+        if self.camera is not None:
+            self.camera.release()
+            self.camera = None
+
+    def _reconnect(self):
+        """Release the device and try to open it again"""
+        self._release()
+        self.reconnect_attempts += 1
+        self.log(f"🔄 Kết nối lại... (lần {self.reconnect_attempts})")
+        time.sleep(2)
+        self._open()
+
+    def _is_behind(self, grab_ms):
+        """True if the frame just grabbed came out of the buffer rather than the live edge.
+
+        A grab that returns much faster than the frame interval was already
+        buffered. Once a grab has blocked (live edge reached after opening),
+        stream timestamps take over: offset = wall clock - CAP_PROP_POS_MSEC
+        is smallest for a frame read as soon as it arrives, so anything
+        noticeably above that minimum is buffered. This keeps short network
+        bursts from being drained while still catching real backlogs.
+        """
+        fast_grab = grab_ms < self.frame_interval_ms * 0.25
+
+        pos_ms = self.camera.get(cv2.CAP_PROP_POS_MSEC)
+        if pos_ms <= 0 or pos_ms == self._last_pos_ms:
+            # Không có timestamp: chỉ dựa vào thời gian grab
+            return fast_grab
+        self._last_pos_ms = pos_ms
+
+        offset_ms = time.monotonic() * 1000 - pos_ms
+        if self._min_offset_ms is None or offset_ms < self._min_offset_ms:
+            self._min_offset_ms = offset_ms
+        else:
+            # Cho phép đồng hồ camera lệch dần so với máy chủ
+            self._min_offset_ms += 0.05
+        self.lag_ms = offset_ms - self._min_offset_ms
+
+        if not self._live_edge_seen:
+            if not fast_grab:
+                self._live_edge_seen = True
+            return fast_grab
+
+        tolerance_ms = self.live_tolerance_ms or self.frame_interval_ms * 1.5
+        return self.lag_ms > tolerance_ms
+
+    def _ring_slot(self):
+        """Next free ring slot to decode into (None = let OpenCV allocate)"""
+        self._ring_index = None
+        if self.ring is None:
+            return None
+        self._ring_index = self.ring.acquire()
+        if self._ring_index is None:
+            return None
+        return self.ring.frames[self._ring_index]
+
+    def _read(self):
+        """Grab until the live edge, then convert only that frame to BGR"""
+        if not self.use_rtsp:
+            return self.camera.read(self._ring_slot())
+
+        for drained in range(self.max_drain + 1):
+            started = time.monotonic()
+            if not self.camera.grab():
+                return False, None
+            if not self._is_behind((time.monotonic() - started) * 1000):
+                break
+        self.drained_frames += drained
+        return self.camera.retrieve(self._ring_slot())
+
+    def stats(self):
+        return {
+            "connected": self.is_connected,
+            "frames": self._seq,
+            "lag_ms": round(self.lag_ms, 1),
+            "drained_frames": self.drained_frames,
+            "ring": self.ring.stats() if self.ring is not None else None,
+            "old_rings": len(self._old_rings),
+        }
+
+    def is_intact(self, seq, frame):
+        """False if frame lives in a ring slot that was reused after it was published.
+
+        Call after reading the frame: a True result means the read saw
+        only the pixels of seq.
+        """
+        ring = self.ring
+        return ring is None or not ring.contains(frame) or ring.holds(seq)
+
+    def pin(self, seq):
+        """Keep the ring slot of seq for a slow consumer (detection) until unpin(seq)"""
+        return self.ring is not None and self.ring.pin(seq)
+
+    def unpin(self, seq):
+        if self.ring is not None:
+            self.ring.unpin(seq)
+        if self._old_rings:
+            for ring in self._old_rings:
+                ring.unpin(seq)
+            self._close_old_rings()
+
+    def frame_address(self, seq):
+        """(shared memory name, offset) of a ring frame for worker processes, None if not in the ring"""
+        if self.ring is None:
+            return None
+        return self.ring.address(seq)
+
+    def _unlink_ring(self):
+        for ring in self._old_rings + (self.ring,):
+            if ring is not None:
+                ring.unlink()
+
+    def _close_old_rings(self):
+        """Close replaced rings once nothing pins them, then report their names.
+
+        A worker process may still map a closed ring: on_ring_closed(name)
+        lets the owner tell it to drop the mapping (ProcessDetector.retire).
+        """
+        with self._ring_lock:
+            idle = [ring for ring in self._old_rings if not ring.pinned]
+            self._old_rings = tuple(ring for ring in self._old_rings if ring.pinned)
+        for ring in idle:
+            name = ring.name
+            ring.close()
+            if self.on_ring_closed is not None:
+                self.on_ring_closed(name)
+
+    def _place(self, frame):
+        """Ring slot index holding frame, creating or resizing the ring on first use"""
+        index = self._ring_index
+        self._ring_index = None
+        if self.ring is not None and index is not None and self.ring.contains(frame):
+            return index
+
+        if self.ring_slots and (self.ring is None or self.ring.shape != frame.shape):
+            # Frame đầu tiên hoặc camera đổi độ phân giải
+            old_ring = self.ring
+            self.ring = FrameRing(frame.shape, self.ring_slots, frame.dtype)
+            if old_ring is not None:
+                # Frame đang được detect vẫn đọc ring cũ: chỉ đóng khi hết pin
+                with self._ring_lock:
+                    self._old_rings += (old_ring,)
+                self._close_old_rings()
+        return None
+
+    def _publish(self, frame):
+        index = self._place(frame)
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+            if index is not None:
+                self.ring.commit(index, seq)
+            self._frame = frame
+            self._frame_time = time.time()
+            self._cond.notify_all()
+
+        for mailbox in self._subscribers:
+            mailbox.put(seq, frame)
+
+        if self.on_frame is not None:
+            self.on_frame(seq, frame)
+
+    def _run(self):
+        failed_reads = 0
+        self._open()
+
+        while True:
+            try:
+                if self.camera is None or not self.camera.isOpened():
+                    if self.reconnect_attempts < self.max_reconnect_attempts:
+                        self._reconnect()
+                    else:
+                        time.sleep(1)
+                    continue
+
+                success, frame = self._read()
+
+                if not success:
+                    failed_reads += 1
+                    if failed_reads >= self.max_failed_reads:
+                        self.log("⚠️ Mất kết nối. Đang kết nối lại...")
+                        self._reconnect()
+                        failed_reads = 0
+                    time.sleep(0.1)
+                    continue
+
+                failed_reads = 0
+                self._publish(frame)
+            except Exception as e:
+                print(f"Capture thread error: {e}")
+                time.sleep(1)
+
+
+class _PendingChunk:
+    __slots__ = ("ready", "chunk")
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.chunk = None
+
+
+def detection_events(snapshot, fps=15, keepalive=15.0, fit="stretch"):
+    """Server-Sent Events stream of detection snapshots for client-side box drawing.
+
+    snapshot() returns the current immutable Detections; every detector
+    result or tracker step publishes a new object, so identity tells whether
+    anything changed. At most fps events per second, plus a comment line
+    every keepalive seconds so idle connections are not dropped by proxies.
+    fit tells the client how frame_size maps onto the streamed image:
+    "stretch" (resized to the stream size) or "crop" (center-cropped to
+    the stream's aspect ratio first, like crop_region in app_yolo.py).
+    """
+    pacer = FramePacer(fps)
+    last = None
+    last_sent = time.monotonic()
+    while True:
+        detections = snapshot()
+        now = time.monotonic()
+        if detections is not last:
+            last = detections
+            last_sent = now
+            yield f"data: {json.dumps(dict(detections.to_dict(), fit=fit))}\n\n"
+        elif now - last_sent >= keepalive:
+            last_sent = now
+            yield ": keepalive\n\n"
+        pacer.wait()
+
+
+def changed_values(old, new):
+    """Keys of new whose value differs from old; nested dicts are compared key by key"""
+    delta = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = changed_values(previous, value)
+            if nested:
+                delta[key] = nested
+        elif key not in old or value != previous:
+            delta[key] = value
+    return delta
+
+
+def dashboard_events(status, logs, rate=10, keepalive=15.0, max_logs=20):
+    """Server-Sent Events stream replacing /api/status and /api/logs polling.
+
+    status() returns a fresh dict (sensor values, person count, ...); only
+    the values that changed since the last event are sent, as an
+    "event: status". logs is the app's LogRing: entries after the last
+    sequence number sent go out oldest first as an "event: log". The first
+    event of a connection (and any gap longer than max_logs) carries the
+    latest max_logs entries with reset: true, so a reconnecting EventSource
+    starts clean.
+    """
+    pacer = FramePacer(rate)
+    sent_status = {}
+    last_seq = None
+    last_sent = time.monotonic()
+    while True:
+        now = time.monotonic()
+        messages = []
+
+        current = status()
+        delta = changed_values(sent_status, current)
+        if delta:
+            messages.append(("status", delta))
+            sent_status = current
+
+        if last_seq is None:
+            entries, reset = logs.latest(max_logs)[::-1], True
+        else:
+            entries = logs.since(last_seq)
+            reset = len(entries) > max_logs
+        if entries or reset:
+            messages.append(("log", {"reset": reset, "entries": entries[-max_logs:]}))
+            if entries:
+                last_seq = entries[-1]["seq"]
+            elif last_seq is None:
+                last_seq = 0   # Log trống: mọi entry sau này đều mới
+
+        if messages:
+            last_sent = now
+            yield "".join(f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in messages)
+        elif now - last_sent >= keepalive:
+            last_sent = now
+            yield ": keepalive\n\n"
+        pacer.wait()
+
+
+class EncodedFrameCache:
+    """Encode each (frame seq, profile) exactly once and share the bytes with every viewer"""
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, seq, profile, render, variant=None):
+        """Return the cached chunk for (seq, profile, variant), calling render() only on first use.
+
+        Concurrent viewers asking for the same key wait for the first one to
+        finish instead of encoding the same pixels again. variant separates
+        renders of one frame that differ in overlay (boxes drawn or clean).
+        """
+        key = (seq, profile, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = _PendingChunk()
+                self._entries[key] = entry
+                self.misses += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self.hits += 1
+
+        if owner:
+            try:
+                entry.chunk = render()
+            finally:
+                entry.ready.set()
+        else:
+            entry.ready.wait()
+        return entry.chunk
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+class AdaptiveBitrate:
+    """Per-viewer closed loop that picks a ladder rung from socket backpressure.
+
+    The WSGI server writes each yielded chunk before resuming the generator,
+    so the time spent in ``yield`` is how long the chunk took to drain into
+    the socket. When that stays above the frame budget the client is falling
+    behind and the controller steps quality/resolution/fps down; when it stays
+    well below for a while it steps back up. Rungs are capped at the profile
+    the client asked for, and viewers on the same rung share encoded frames.
+    """
+
+    def __init__(self, ceiling, ladder=ABR_LADDER, max_latency=0.25,
+                 down_ratio=0.8, up_ratio=0.3, up_after=45, hold_frames=5):
+        rungs = []
+        for rung in ladder:
+            capped = cap_profile(rung, ceiling)
+            if capped not in rungs:
+                rungs.append(capped)
+        if ceiling not in rungs:
+            rungs.append(ceiling)
+        self.rungs = rungs
+        self.level = len(rungs) - 1
+        self.max_latency = max_latency
+        self.down_ratio = down_ratio
+        self.up_ratio = up_ratio
+        self.up_after = up_after
+        self.hold_frames = hold_frames
+
+        self.drain_avg = 0.0
+        self.switches = 0
+        self._good = 0
+        self._hold = 0
+
+    @property
+    def profile(self):
+        return self.rungs[self.level]
+
+    def budget(self):
+        """Time one chunk may spend draining before latency starts to build"""
+        return min(1.0 / self.profile.fps, self.max_latency)
+
+    def on_sent(self, drain_time):
+        """Feed the measured drain time of the last chunk; returns the profile to use next"""
+        self.drain_avg = 0.7 * self.drain_avg + 0.3 * drain_time
+
+        if self._hold > 0:
+            self._hold -= 1
+            return self.profile
+
+        budget = self.budget()
+        if self.drain_avg > budget * self.down_ratio and self.level > 0:
+            self._switch(self.level - 1)
+        elif self.drain_avg < budget * self.up_ratio:
+            self._good += 1
+            if self._good >= self.up_after and self.level < len(self.rungs) - 1:
+                self._switch(self.level + 1)
+        else:
+            self._good = 0
+        return self.profile
+
+    def _switch(self, level):
+        self.level = level
+        self.switches += 1
+        self._good = 0
+        self._hold = self.hold_frames
+        # Bắt đầu lại ước lượng ở mức trung tính cho bậc mới
+        self.drain_avg = self.budget() * 0.5
+
+    def stats(self):
+        return {
+            "profile": self.profile._asdict(),
+            "level": self.level,
+            "levels": len(self.rungs),
+            "drain_ms": round(self.drain_avg * 1000, 1),
+            "switches": self.switches,
+        }
@@ -0,0 +1,204 @@
+"""
+SAR-BOT PRO - Box Tracking
+Dời box theo người bằng optical flow giữa hai lần detection, giữ ID ổn định cho từng người
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from detection import Detections
+
+# Lucas-Kanade trên frame xám nhỏ: đủ chính xác cho box, tốn ~1ms mỗi frame
+LK_PARAMS = dict(
+    winSize=(15, 15),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU of two N x 4 / M x 4 arrays of (x, y, w, h)"""
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    inter_w = np.clip(np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2])
+                      - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3])
+                      - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def _box_points(boxes, grid=4):
+    """grid x grid sample points inside the central part of every box"""
+    steps = (np.arange(grid) + 0.5) / grid * 0.6 + 0.2   # 20%..80% của box, tránh nền
+    gx, gy = np.meshgrid(steps, steps)
+    gx, gy = gx.ravel(), gy.ravel()
+    points = np.empty((len(boxes), grid * grid, 2), dtype=np.float32)
+    points[..., 0] = boxes[:, 0:1] + gx * boxes[:, 2:3]
+    points[..., 1] = boxes[:, 1:2] + gy * boxes[:, 3:4]
+    return points.reshape(-1, 1, 2)
+
+
+def flow_boxes(prev_gray, gray, boxes, grid=4, min_points=3):
+    """Shift each box by the median optical flow of points sampled inside it"""
+    if len(boxes) == 0:
+        return boxes
+    points = _box_points(boxes, grid)
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, **LK_PARAMS)
+
+    shift = (moved - points).reshape(len(boxes), grid * grid, 2)
+    valid = status.reshape(len(boxes), grid * grid).astype(bool)
+    boxes = boxes.copy()
+    for i in range(len(boxes)):
+        if valid[i].sum() >= min_points:
+            boxes[i, :2] += np.median(shift[i][valid[i]], axis=0)
+    return boxes
+
+
+class BoxTracker:
+    """Keep detection boxes on moving people between detection runs.
+
+    advance() is called for every captured frame: points inside each
+    tracked box are followed with Lucas-Kanade optical flow on a small
+    grayscale copy of the frame. update() is called with each detection
+    result: boxes are first carried forward from the (older) detected
+    frame to the newest frame, then matched to existing tracks by IoU so
+    a person keeps the same ID. Both return an immutable Detections
+    snapshot in the detection frame's coordinates.
+    """
+
+    def __init__(self, flow_width=320, iou_threshold=0.3, max_misses=1, history=8):
+        self.flow_width = flow_width
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.history = history
+
+        self._lock = threading.Lock()
+        self._gray = None           # (seq, frame xám mới nhất)
+        self._kept = OrderedDict()  # seq -> frame xám của các frame gửi đi detection
+        self._scale = None          # flow px / detection px: (x, y, w, h), x và y riêng
+
+        # Track: box theo tọa độ frame flow
+        self._boxes = np.zeros((0, 4), dtype=np.float32)
+        self._scores = np.zeros(0, dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int32)
+        self._misses = np.zeros(0, dtype=np.int32)
+        self._frame_size = None
+        self._next_id = 1
+
+        self.advanced = 0
+        self.advance_ms = 0.0
+
+    def _to_gray(self, frame):
+        h, w = frame.shape[:2]
+        flow_h = max(2, round(self.flow_width * h / w))
+        small = cv2.resize(frame, (self.flow_width, flow_h), interpolation=cv2.INTER_LINEAR)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def _flow_scale(self, frame_size, gray):
+        """Per-axis scale from detection to flow coordinates.
+
+        The flow frame keeps the camera's aspect ratio while detection may
+        run on a fixed 16:9 resize, so x and y are scaled separately.
+        """
+        sx = self.flow_width / frame_size[0]
+        sy = gray.shape[0] / frame_size[1] if gray is not None else sx
+        return np.array([sx, sy, sx, sy], dtype=np.float32)
+
+    def advance(self, seq, frame, keep=False):
+        """Move tracked boxes to this frame; keep=True remembers it for the detection result.
+
+        Returns a new snapshot, or None if nothing is tracked.
+        """
+        with self._lock:
+            if len(self._ids) == 0 and not keep:
+                self._gray = None
+                return None
+
+            started = time.monotonic()
+            gray = self._to_gray(frame)
+            if keep:
+                self._kept[seq] = gray
+                while len(self._kept) > self.history:
+                    self._kept.popitem(last=False)
+
+            if len(self._ids) == 0:
+                self._gray = (seq, gray)
+                return None
+
+            if self._gray is not None:
+                self._boxes = flow_boxes(self._gray[1], gray, self._boxes)
+            self._gray = (seq, gray)
+
+            self.advance_ms = 0.9 * self.advance_ms + 0.1 * (time.monotonic() - started) * 1000
+            self.advanced += 1
+            return self._snapshot(seq)
+
+    def update(self, detections):
+        """Merge a detection result into the tracks; returns the new snapshot"""
+        with self._lock:
+            self._frame_size = detections.frame_size
+            source = self._kept.pop(detections.frame_id, None)
+            if detections.frame_size is not None:
+                gray = source if source is not None else (self._gray[1] if self._gray is not None else None)
+                self._scale = self._flow_scale(detections.frame_size, gray)
+            scale = self._scale if self._scale is not None else 1.0
+            boxes = detections.boxes * scale
+
+            # Frame đã detect cũ hơn frame hiện tại: dời box tới hiện tại
+            if source is not None:
+                if self._gray is None:
+                    self._gray = (detections.frame_id, source)
+                elif self._gray[0] != detections.frame_id:
+                    boxes = flow_boxes(source, self._gray[1], boxes)
+
+            self._match(boxes, detections.scores)
+            return self._snapshot(detections.frame_id)
+
+    def _match(self, boxes, scores):
+        """Greedy IoU matching of detections to tracks"""
+        track_of = np.full(len(boxes), -1)
+        if len(self._boxes) and len(boxes):
+            iou = iou_matrix(self._boxes, boxes)
+            while True:
+                t, d = np.unravel_index(np.argmax(iou), iou.shape)
+                if iou[t, d] < self.iou_threshold:
+                    break
+                track_of[d] = t
+                iou[t, :] = -1
+                iou[:, d] = -1
+
+        matched = track_of[track_of >= 0]
+        misses = self._misses + 1
+        misses[matched] = 0
+        keep = misses <= self.max_misses
+        keep[matched] = False
+
+        new = track_of < 0
+        new_ids = np.arange(self._next_id, self._next_id + new.sum(), dtype=np.int32)
+        self._next_id += len(new_ids)
+
+        # Box đã match lấy vị trí từ detection; track không match được giữ lại max_misses lần
+        self._boxes = np.concatenate([boxes[~new], boxes[new], self._boxes[keep]]).astype(np.float32)
+        self._scores = np.concatenate([scores[~new], scores[new], self._scores[keep]])
+        self._ids = np.concatenate([self._ids[track_of[~new]], new_ids, self._ids[keep]])
+        self._misses = np.concatenate([np.zeros((~new).sum() + new.sum(), dtype=np.int32),
+                                       misses[keep]])
+
+    def _snapshot(self, frame_id):
+        scale = self._scale if self._scale is not None else 1.0
+        return Detections(self._boxes / scale, self._scores, frame_id=frame_id,
+                          frame_size=self._frame_size, track_ids=self._ids)
+
+    def stats(self):
+        return {
+            "tracks": len(self._ids),
+            "next_id": self._next_id,
+            "advanced": self.advanced,
+            "advance_ms": round(self.advance_ms, 2),
+        }